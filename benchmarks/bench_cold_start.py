@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from sklearn.svm import SVC
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Run in a fresh interpreter per configuration, as a new endpoint instance would
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {src!r})
+import numpy as np
+import predict
+imported = time.perf_counter()
+model = predict.load_model({model_dir!r}, mmap_mode={mmap_mode!r}, warm_up={warm_up!r})
+loaded = time.perf_counter()
+predict.predict_fn(np.zeros((1, {n_features})), model)
+first = time.perf_counter()
+predict.predict_fn(np.zeros((1, {n_features})), model)
+second = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'model_fn': loaded - imported, 'first': first - loaded,
+                  'second': second - first, 'total': first - start}}))
+'''
+
+
+# A model with many support vectors, as a large training set gives
+def model_dir(rows, n_features):
+    rng = np.random.RandomState(0)
+    x = rng.rand(rows, n_features)
+    y = rng.randint(0, 2, rows)
+
+    directory = tempfile.mkdtemp()
+    start = time.perf_counter()
+    model = SVC(gamma='auto').fit(x, y)
+    joblib.dump(model, os.path.join(directory, 'model.joblib'))
+    print('{} support vectors of {} features, {:.1f}MB, trained in {:.1f}s'.format(
+        model.support_vectors_.shape[0], n_features, model.support_vectors_.nbytes / 1e6,
+        time.perf_counter() - start))
+    return directory
+
+
+def main(rows, n_features, repeat):
+    directory = model_dir(rows, n_features)
+
+    print('{:>6} {:>7} {:>9} {:>11} {:>11} {:>11} {:>9}'.format(
+        'mmap', 'warm-up', 'import(s)', 'model_fn(s)', 'first(ms)', 'second(ms)', 'total(s)'))
+    for mmap_mode, warm_up in ((None, False), (None, True), ('r', False), ('r', True)):
+        runs = []
+        for _ in range(repeat):
+            code = COLD_START.format(src=SRC_DIR, model_dir=directory, mmap_mode=mmap_mode, warm_up=warm_up,
+                                     n_features=n_features)
+            output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+        best = {name: min(run[name] for run in runs) for name in runs[0]}
+        print('{:>6} {:>7} {:>9.3f} {:>11.3f} {:>11.2f} {:>11.2f} {:>9.3f}'.format(
+            str(mmap_mode), str(warm_up), best['import'], best['model_fn'], best['first'] * 1000,
+            best['second'] * 1000, best['total']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time to first prediction of a fresh serving process')
+    parser.add_argument('--rows', type=int, default=10000, help='training rows of the synthetic model')
+    parser.add_argument('--features', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.rows, args.features, args.repeat)
@@ -0,0 +1,86 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import collusion  # noqa: E402
+import corpus  # noqa: E402
+
+# Pairs of answers scored one by one to estimate the cost of comparing all pairs
+NAIVE_SAMPLE = 200
+
+
+# One task with a source, answers of every category and copies of other answers, as pre-processed texts
+def create_task(answers, copies, source_words, answer_words, seed):
+    rng = np.random.RandomState(seed)
+    vocabulary = corpus.create_vocabulary(20000, rng)
+    source = corpus.sample_words(vocabulary, source_words, rng)
+
+    rows = [('orig_taska.txt', 'a', -1, source)]
+    for answer in range(answers - copies):
+        category = corpus.CATEGORIES[answer % len(corpus.CATEGORIES)]
+        length = max(1, int(answer_words * rng.uniform(0.5, 1.5)))
+        if category == 'non':
+            words = corpus.sample_words(vocabulary, length, rng)
+        else:
+            start = rng.randint(0, max(1, source_words - length))
+            words = corpus.rewrite(source[start:start + length], category, vocabulary, rng)
+        rows.append(('g{}_taska.txt'.format(answer), 'a', corpus.CATEGORIES.index(category), words))
+
+    # light rewrites of earlier non answers, the pairs the detection has to find
+    originals = rng.choice(np.arange(0, answers - copies, len(corpus.CATEGORIES)), size=copies, replace=False)
+    copied = []
+    for copy, original in enumerate(originals):
+        file = 'copy{}_taska.txt'.format(copy)
+        rows.append((file, 'a', 0, corpus.rewrite(rows[original + 1][3], 'light', vocabulary, rng)))
+        copied.append({rows[original + 1][0], file})
+
+    df = pd.DataFrame([(file, task, category, ' '.join(words)) for file, task, category, words in rows],
+                      columns=['File', 'Task', 'Category', 'Text'])
+    return df, copied
+
+
+def main(sizes, copies, source_words, answer_words, seed):
+    print('{:>8} {:>12} {:>11} {:>10} {:>8} {:>14}'.format('answers', 'pairs', 'candidates', 'found', 'seconds',
+                                                          'all pairs (s)'))
+    for answers in sizes:
+        df, copied = create_task(answers, copies, source_words, answer_words, seed)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = collusion.detect_collusion(df)
+        seconds = time.perf_counter() - start
+
+        pairs = [set(pair) for pair in zip(result['File_a'], result['File_b'])]
+        found = sum(pair in pairs for pair in copied)
+
+        # the pair features of a sample of random pairs, times the number of pairs
+        texts = list(df['Text'][1:])
+        rng = np.random.RandomState(seed)
+        sample = [rng.choice(len(texts), 2, replace=False) for _ in range(NAIVE_SAMPLE)]
+        start = time.perf_counter()
+        for i, j in sample:
+            collusion.pair_features(texts[i], texts[j], [1, 5])
+        all_pairs = len(texts) * (len(texts) - 1) // 2
+        naive_seconds = (time.perf_counter() - start) / NAIVE_SAMPLE * all_pairs
+
+        print('{:>8} {:>12} {:>11} {:>7}/{:<2} {:>8.2f} {:>14.0f}'.format(
+            len(texts), all_pairs, len(result), found, len(copied), seconds, naive_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collusion detection with sparse blocking against all pairs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='answers of the task')
+    parser.add_argument('--copies', type=int, default=20, help='answers that copy another answer')
+    parser.add_argument('--source-words', type=int, default=1500)
+    parser.add_argument('--answer-words', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.sizes, args.copies, args.source_words, args.answer_words, args.seed)
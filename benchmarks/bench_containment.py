@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+
+
+# The corpus repeated copies times, every copy with its own tasks and sources
+def replicate(df, copies):
+    return pd.concat([df.assign(File=df['File'] + '.' + str(i), Task=df['Task'] + '.' + str(i))
+                      for i in range(copies)], ignore_index=True)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main(csv_file, data_dir, ngram_range, copies):
+    df = helpers.create_text_column(helpers.numerical_dataframe(csv_file), data_dir)
+    lookup = helpers.create_lookup(df)
+
+    # one vectorizer per pair, the reference
+    answers = [file for file, row in lookup['rows'].items() if row['Category'] > -1]
+    for n in ngram_range:
+        pairwise, pairwise_time = timed(lambda: [helpers.calculate_containment(df, n, file, lookup=lookup)
+                                                 for file in answers])
+        sparse, sparse_time = timed(lambda: helpers.create_containment_features_sparse(df, n, lookup=lookup))
+        sparse = [value for value in sparse if value != -1]
+        assert np.allclose(pairwise, sparse, equal_nan=True), 'c_{} differs'.format(n)
+        print('c_{}: {} answers, pairwise {:.3f}s, sparse {:.3f}s'.format(n, len(answers), pairwise_time,
+                                                                         sparse_time))
+
+    big = replicate(df, copies)
+    big_lookup = helpers.create_lookup(big)
+    for n in ngram_range:
+        profile, profile_time = timed(lambda: helpers.create_containment_features(big, n, lookup=big_lookup))
+        sparse, sparse_time = timed(lambda: helpers.create_containment_features_sparse(big, n, lookup=big_lookup))
+        assert np.array_equal(profile, sparse, equal_nan=True), 'c_{} differs'.format(n)
+        print('c_{}: {} rows, profiles {:.3f}s, sparse {:.3f}s'.format(n, len(big), profile_time, sparse_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched sparse containment against the per-pair implementations')
+    parser.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    parser.add_argument('--data-dir', type=str, default='data/')
+    parser.add_argument('--ngrams', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--copies', type=int, default=100, help='copies of the corpus for the large run')
+    args = parser.parse_args()
+
+    main(args.csv_file, args.data_dir, args.ngrams, args.copies)
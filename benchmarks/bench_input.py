@@ -0,0 +1,55 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+import predict  # noqa: E402
+
+
+# Request bodies of every feature content type for one array
+def payloads(x):
+    bodies = {'application/x-float32': helpers.pack_float32(x)}
+
+    buffer = io.BytesIO()
+    np.save(buffer, x.astype(np.float32), allow_pickle=False)
+    bodies['application/x-npy'] = buffer.getvalue()
+
+    buffer = io.BytesIO()
+    np.save(buffer, x, allow_pickle=True)
+    bodies['application/python-pickle'] = buffer.getvalue()
+
+    buffer = io.BytesIO()
+    np.savetxt(buffer, x, delimiter=',', fmt='%g')
+    bodies['text/csv'] = buffer.getvalue()
+
+    return bodies
+
+
+def main(rows, columns, repeat):
+    print('{:>9} {:>26} {:>12} {:>14}'.format('rows', 'content type', 'bytes', 'input_fn(us)'))
+    for count in rows:
+        x = np.random.RandomState(0).rand(count, columns)
+        for content_type, body in payloads(x).items():
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                decoded = predict.input_fn(body, content_type)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            assert decoded.shape == x.shape and np.allclose(decoded, x, atol=1e-5), content_type
+            print('{:>9} {:>26} {:>12} {:>14.1f}'.format(count, content_type, len(body), best * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deserialization time of the input_fn content types')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 1000, 1000000])
+    parser.add_argument('--columns', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.rows, args.columns, args.repeat)
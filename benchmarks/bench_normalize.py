@@ -0,0 +1,58 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+
+
+# The five pass re.sub normalization process_file used before normalize_text, kept as the reference
+def legacy_normalize(text):
+    all_text = text.lower()
+    all_text = re.sub(r"[^a-zA-Z0-9]", " ", all_text)
+    all_text = re.sub(r"\t", " ", all_text)
+    all_text = re.sub(r"\n", " ", all_text)
+    all_text = re.sub("  ", " ", all_text)
+    all_text = re.sub("   ", " ", all_text)
+    return all_text
+
+
+# Build a text of at least size_mb megabytes by repeating the raw corpus files
+def make_input(data_dir, size_mb):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.txt'))):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as file:
+            corpus.append(file.read())
+    corpus = '\n\n'.join(corpus)
+
+    repeats = int(size_mb * 1024 * 1024 / len(corpus)) + 1
+    return corpus * repeats
+
+
+def main(data_dir, sizes, repeat):
+    for size_mb in sizes:
+        text = make_input(data_dir, size_mb)
+
+        # the compatibility mode must reproduce the legacy output exactly
+        assert helpers.normalize_text(text, compat=True) == legacy_normalize(text), 'compat output differs'
+        assert helpers.normalize_text(text).split() == legacy_normalize(text).split(), 'tokens differ'
+
+        legacy = min(timeit.repeat(lambda: legacy_normalize(text), number=1, repeat=repeat))
+        single = min(timeit.repeat(lambda: helpers.normalize_text(text), number=1, repeat=repeat))
+        compat = min(timeit.repeat(lambda: helpers.normalize_text(text, compat=True), number=1, repeat=repeat))
+
+        print('{:.1f} MB: legacy {:.4f}s, normalize_text {:.4f}s ({:.1f}x), compat {:.4f}s ({:.1f}x)'.format(
+            len(text) / 1024 / 1024, legacy, single, legacy / single, compat, legacy / compat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark normalize_text against the legacy re.sub passes')
+    parser.add_argument('--data-dir', type=str, default='data')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.data_dir, args.sizes, args.repeat)
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from sklearn.svm import SVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+import predict  # noqa: E402
+
+
+def main(csv_file, data_dir, features, repeat):
+    df = helpers.create_text_column(helpers.numerical_dataframe(csv_file), data_dir)
+    lookup = helpers.create_lookup(df)
+    sources = {task: (file, lookup['rows'][file]['Text']) for task, file in lookup['sources'].items()}
+    answers = [file for file, row in lookup['rows'].items() if row['Category'] > -1]
+
+    # the model and source profiles train.py would save
+    ngram_range = [int(feature[2:]) for feature in features if feature != 'lcs_word']
+    exact = helpers.create_features(df, ngram_range, lookup=lookup)
+    x = np.array([[exact[feature][i] for feature in features] for i, file in enumerate(df['File'])
+                  if lookup['rows'][file]['Category'] > -1])
+    y = [lookup['rows'][file]['Category'] > 0 for file in answers]
+
+    model_dir = tempfile.mkdtemp()
+    joblib.dump(SVC(gamma='auto').fit(x, y), os.path.join(model_dir, 'model.joblib'))
+    joblib.dump(helpers.create_source_profiles(sources, features), os.path.join(model_dir, 'sources.joblib'))
+    model = predict.model_fn(model_dir)
+
+    # raw texts as a client sends them
+    requests = []
+    for file in answers:
+        with open(os.path.join(data_dir, file), encoding='utf-8', errors='ignore') as text_file:
+            requests.append(json.dumps({'text': text_file.read(), 'task': lookup['rows'][file]['Task']}))
+
+    for i, request in enumerate(requests):
+        served = predict.text_features(predict.input_fn(request, 'application/json'), model['sources'])
+        assert np.allclose(served[0], x[i], equal_nan=True), 'features of {} differ'.format(answers[i])
+
+    latencies = []
+    for _ in range(repeat):
+        for request in requests:
+            start = time.perf_counter()
+            predict.predict_fn(predict.input_fn(request, 'application/json'), model)
+            latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    words = [len(helpers.normalize_text(json.loads(request)['text']).split()) for request in requests]
+    print('{} requests, {:.0f} words on average: p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms'.format(
+        len(latencies), np.mean(words), np.percentile(latencies, 50), np.percentile(latencies, 99),
+        latencies.max()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per request latency of raw text predictions')
+    parser.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    parser.add_argument('--data-dir', type=str, default='data/')
+    parser.add_argument('--features', type=str, nargs='+', default=['c_1', 'c_5', 'lcs_word'])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    main(args.csv_file, args.data_dir, args.features, args.repeat)
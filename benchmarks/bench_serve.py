@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from sklearn.svm import SVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+import predict  # noqa: E402
+import serve  # noqa: E402
+
+
+# A model with source profiles in a temporary model directory, as train.py saves it
+def model_dir(csv_file, data_dir, features):
+    df = helpers.create_text_column(helpers.numerical_dataframe(csv_file), data_dir)
+    lookup = helpers.create_lookup(df)
+    sources = {task: (file, lookup['rows'][file]['Text']) for task, file in lookup['sources'].items()}
+    answers = [file for file, row in lookup['rows'].items() if row['Category'] > -1]
+
+    profiles = helpers.create_source_profiles(sources, features)
+    x = [helpers.profile_features(lookup['rows'][file]['Text'], profiles['sources'][lookup['rows'][file]['Task']],
+                                  features, profiles['ngram_range']) for file in answers]
+    y = [lookup['rows'][file]['Category'] > 0 for file in answers]
+
+    directory = tempfile.mkdtemp()
+    joblib.dump(SVC(gamma='auto').fit(x, y), os.path.join(directory, 'model.joblib'))
+    joblib.dump(profiles, os.path.join(directory, 'sources.joblib'))
+
+    texts = []
+    for file in answers:
+        with open(os.path.join(data_dir, file), encoding='utf-8', errors='ignore') as text_file:
+            texts.append({'text': text_file.read(), 'task': lookup['rows'][file]['Task']})
+
+    return directory, np.array(x), texts
+
+
+# One keep-alive client sending requests one after the other
+async def client(port, bodies, content_type, latencies, statuses):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for body in bodies:
+        start = time.perf_counter()
+        writer.write('POST /invocations HTTP/1.1\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'.format(
+            content_type, len(body)).encode('latin-1') + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line == b'\r\n':
+                break
+            if line.lower().startswith(b'content-length'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+async def run(directory, bodies, content_type, clients, max_batch, max_wait_ms, max_queue):
+    batcher = serve.create_batcher(predict.model_fn(directory), max_batch, max_wait_ms / 1000, max_queue)
+    loop_task = asyncio.ensure_future(serve.batch_loop(batcher))
+    server = await asyncio.start_server(lambda r, w: serve.handle_connection(batcher, r, w), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, bodies[i::clients], content_type, latencies, statuses)
+                           for i in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    loop_task.cancel()
+    batcher['executor'].shutdown()
+
+    latencies = np.array(latencies) * 1000
+    report = serve.metrics_report(batcher)
+    print('{:>5} {:>9} {:>9.0f} {:>8.2f} {:>8.2f} {:>9.1f} {:>8}'.format(
+        max_batch, content_type.split('/')[1], len(latencies) / elapsed, np.percentile(latencies, 50),
+        np.percentile(latencies, 99), report['mean_batch_rows'], statuses.get(503, 0)))
+
+
+def main(csv_file, data_dir, features, clients, requests, max_batches, max_wait_ms, max_queue):
+    directory, x, texts = model_dir(csv_file, data_dir, features)
+
+    arrays = []
+    for i in range(requests):
+        buffer = io.BytesIO()
+        np.save(buffer, x[i % len(x)][np.newaxis])
+        arrays.append(buffer.getvalue())
+    documents = [json.dumps(texts[i % len(texts)]).encode('utf-8') for i in range(requests)]
+
+    print('{} clients, {} single row requests'.format(clients, requests))
+    print('{:>5} {:>9} {:>9} {:>8} {:>8} {:>9} {:>8}'.format(
+        'batch', 'content', 'req/s', 'p50(ms)', 'p99(ms)', 'rows/call', '503'))
+    for max_batch in max_batches:
+        for bodies, content_type in ((arrays, 'application/python-pickle'), (documents, 'application/json')):
+            asyncio.run(run(directory, bodies, content_type, clients, max_batch, max_wait_ms, max_queue))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the batching server under concurrent clients')
+    parser.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    parser.add_argument('--data-dir', type=str, default='data/')
+    parser.add_argument('--features', type=str, nargs='+', default=['c_1', 'c_5', 'lcs_word'])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--max-batch', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    args = parser.parse_args()
+
+    main(args.csv_file, args.data_dir, args.features, args.clients, args.requests, args.max_batch,
+         args.max_wait_ms, args.max_queue)
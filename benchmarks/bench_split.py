@@ -0,0 +1,98 @@
+import argparse
+import operator
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+
+
+# The groupby().apply(sample) and row by row .loc labeling create_datatype used before, kept as the reference
+def legacy_create_datatype(df, train_value, test_value, datatype_var, compare_dfcolumn, operator_of_compare,
+                           value_of_compare, sampling_number, sampling_seed):
+    df_subset = df[operator_of_compare(df[compare_dfcolumn], value_of_compare)]
+    df_subset = df_subset.drop(columns=[datatype_var])
+    df_subset.loc[:, datatype_var] = train_value
+
+    df_sampled = df_subset.groupby(['Task', compare_dfcolumn], group_keys=False).apply(
+        lambda x: x.sample(min(len(x), sampling_number), random_state=sampling_seed))
+    df_sampled = df_sampled.drop(columns=[datatype_var])
+    df_sampled.loc[:, datatype_var] = test_value
+
+    for index in df_sampled.index:
+        df_subset.loc[index, datatype_var] = test_value
+
+    for index in df_subset.index:
+        df.loc[index, datatype_var] = df_subset.loc[index, datatype_var]
+
+
+def legacy_train_test_dataframe(clean_df, random_seed=100):
+    new_df = clean_df.copy()
+    new_df.loc[:, 'Datatype'] = 0
+    legacy_create_datatype(new_df, 1, 2, 'Datatype', 'Category', operator.gt, 0, 1, random_seed)
+    legacy_create_datatype(new_df, 1, 2, 'Datatype', 'Category', operator.eq, 0, 2, random_seed)
+    mapping = {0: 'orig', 1: 'train', 2: 'test'}
+    new_df.Datatype = [mapping[item] for item in new_df.Datatype]
+    return new_df
+
+
+# Seeded synthetic manifest with one source per task and answers of every category
+def synthetic_manifest(rows, tasks, seed=0):
+    rng = np.random.RandomState(seed)
+    task_names = ['task{}'.format(i) for i in range(tasks)]
+    answers = rows - tasks
+
+    df = pd.DataFrame({
+        'File': ['file{}.txt'.format(i) for i in range(rows)],
+        'Task': task_names + list(rng.choice(task_names, size=answers)),
+        'Category': [-1] * tasks + list(rng.randint(0, 4, size=answers)),
+    })
+    df['Class'] = np.where(df['Category'] > 0, 1, df['Category'])
+
+    # sources are not always first in a real manifest
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def main(sizes, check_rows, seeds):
+    # same seed, same assignment as the legacy implementation
+    manifests = [helpers.numerical_dataframe('data/file_information.csv'), synthetic_manifest(check_rows, 20)]
+    for manifest in manifests:
+        for seed in seeds:
+            expected = legacy_train_test_dataframe(manifest, seed)['Datatype']
+            actual = helpers.train_test_dataframe(manifest, seed)['Datatype']
+            assert expected.equals(actual), 'assignment differs for seed {}'.format(seed)
+    print('Assignments match the legacy implementation for seeds {}'.format(seeds))
+
+    for rows in sizes:
+        manifest = synthetic_manifest(rows, 1000)
+
+        start = time.perf_counter()
+        helpers.train_test_dataframe(manifest, seeds[0])
+        elapsed = time.perf_counter() - start
+
+        print('{} rows: train_test_dataframe {:.3f}s'.format(rows, elapsed))
+
+    manifest = synthetic_manifest(check_rows, 20)
+    start = time.perf_counter()
+    legacy_train_test_dataframe(manifest, seeds[0])
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    helpers.train_test_dataframe(manifest, seeds[0])
+    vectorized = time.perf_counter() - start
+    print('{} rows: legacy {:.3f}s, vectorized {:.3f}s ({:.0f}x)'.format(
+        check_rows, legacy, vectorized, legacy / vectorized))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stratified train/test split')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--check-rows', type=int, default=5000,
+                        help='rows of the synthetic manifest compared with the legacy implementation')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1, 100])
+    args = parser.parse_args()
+
+    main(args.sizes, args.check_rows, args.seeds)
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import helpers  # noqa: E402
+import winnowing  # noqa: E402
+
+
+# Seconds per call of fn over all answers, best of repeat runs
+def per_answer(fn, answers, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for answer in answers:
+            fn(answer)
+        elapsed = (time.perf_counter() - start) / len(answers)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(csv_file, data_dir, ngram_range, windows, repeat):
+    df = helpers.create_text_column(helpers.numerical_dataframe(csv_file), data_dir)
+    lookup = helpers.create_lookup(df)
+    exact = helpers.create_features(df, ngram_range, lcs_method=None, lookup=lookup)
+
+    answers = [(file, row['Task'], row['Text']) for file, row in lookup['rows'].items() if row['Category'] > -1]
+    source_texts = {task: lookup['rows'][file]['Text'] for task, file in lookup['sources'].items()}
+    is_answer = np.array([lookup['rows'][file]['Category'] > -1 for file in df['File']])
+
+    print('{:>2} {:>6} {:>8} {:>8} {:>12} {:>12} {:>12}'.format(
+        'n', 'window', 'MAE', 'pearson', 'sklearn(us)', 'profile(us)', 'winnow(us)'))
+
+    for n in ngram_range:
+        truth = np.array(exact['c_'+str(n)])[is_answer]
+
+        # exact references: a vectorizer per pair, and cached source profiles with a new answer profile
+        sklearn_time = per_answer(lambda answer: helpers.calculate_containment(df, n, answer[0], lookup=lookup),
+                                  answers[:20], 1)
+        source_profiles = {task: helpers.ngram_profile(text, [n]) for task, text in source_texts.items()}
+        profile_time = per_answer(lambda answer: helpers.profile_containment(
+            helpers.ngram_profile(answer[2], [n]), source_profiles[answer[1]], n), answers, repeat)
+
+        for window in windows:
+            index = winnowing.create_fingerprint_index(n, window)
+            for task, text in source_texts.items():
+                winnowing.add_fingerprints(index, task, text)
+
+            estimate = np.array(winnowing.create_fingerprint_features(df, n, window, index=index, lookup=lookup))
+            estimate = estimate[is_answer]
+            winnow_time = per_answer(lambda answer: winnowing.fingerprint_containment(index, answer[2]),
+                                     answers, repeat)
+
+            print('{:>2} {:>6} {:>8.4f} {:>8.4f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+                n, window, np.mean(np.abs(estimate - truth)), np.corrcoef(estimate, truth)[0, 1],
+                sklearn_time * 1e6, profile_time * 1e6, winnow_time * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accuracy and speed of winnowed containment against exact c_n')
+    parser.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    parser.add_argument('--data-dir', type=str, default='data/')
+    parser.add_argument('--ngrams', type=int, nargs='+', default=[3, 4, 5, 6])
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.csv_file, args.data_dir, args.ngrams, args.windows, args.repeat)
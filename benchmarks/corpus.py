@@ -0,0 +1,114 @@
+import argparse
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+# Share of the passage words an answer of each category replaces with other words
+REWRITE_RATES = {'cut': 0.0, 'light': 0.1, 'heavy': 0.4}
+
+# Answer categories in the order they are assigned within a task
+CATEGORIES = ['non', 'heavy', 'light', 'cut']
+
+
+# A seeded vocabulary of made up words with Zipf distributed frequencies
+def create_vocabulary(size, rng):
+    letters = np.array(list(string.ascii_lowercase))
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters, size=rng.randint(2, 11))))
+
+    # sorted first, set order changes between interpreter runs
+    weights = 1.0 / np.arange(1, size + 1)
+    return rng.permutation(sorted(words)), weights / weights.sum()
+
+
+def sample_words(vocabulary, count, rng):
+    words, probabilities = vocabulary
+    return list(rng.choice(words, size=count, p=probabilities))
+
+
+# Join words into capitalized sentences with punctuation, the noise normalize_text removes
+def to_text(words, rng):
+    sentences = []
+    start = 0
+    while start < len(words):
+        end = start + rng.randint(8, 21)
+        sentence = ' '.join(words[start:end])
+        sentences.append(sentence[:1].upper() + sentence[1:] + rng.choice(['.', '.', '!', '?', ';']))
+        start = end
+    return ' '.join(sentences)
+
+
+# Rewrite a passage of the source: replace a share of its words and, for heavy rewrites, reorder its phrases
+def rewrite(passage, category, vocabulary, rng):
+    words = list(passage)
+    replace = rng.rand(len(words)) < REWRITE_RATES[category]
+    replacements = sample_words(vocabulary, int(replace.sum()), rng)
+    for position, word in zip(np.flatnonzero(replace), replacements):
+        words[position] = word
+
+    if category == 'heavy':
+        phrases = [words[i:i + 12] for i in range(0, len(words), 12)]
+        words = [word for i in rng.permutation(len(phrases)) for word in phrases[i]]
+
+    return words
+
+
+def generate_corpus(directory, tasks=5, answers_per_task=19, source_words=500, answer_words=300, seed=0,
+                    vocabulary_size=20000):
+    '''Writes a seeded synthetic corpus in the layout of data/: one source per task, answers of
+       every category and a file_information.csv with the columns File, Task and Category.
+       Cut answers copy a passage of their source, light and heavy answers rewrite one and
+       non answers are drawn from the vocabulary alone.
+       :param directory: The directory the text files and the csv are written to
+       :param tasks: The number of tasks, each with one source
+       :param answers_per_task: The number of answers per task, the categories take turns
+       :param source_words: The number of words of a source
+       :param answer_words: The mean number of words of an answer, lengths vary by +-50%
+       :param seed: The random seed, the same arguments always give the same corpus
+       :param vocabulary_size: The number of distinct words
+       :return: The path of the csv file'''
+
+    rng = np.random.RandomState(seed)
+    vocabulary = create_vocabulary(vocabulary_size, rng)
+    os.makedirs(directory, exist_ok=True)
+
+    rows = []
+    for task in range(tasks):
+        task_name = 't'+str(task)
+        source = sample_words(vocabulary, source_words, rng)
+        rows.append(('orig_task'+task_name+'.txt', task_name, 'orig', source))
+
+        for answer in range(answers_per_task):
+            category = CATEGORIES[answer % len(CATEGORIES)]
+            length = max(1, int(answer_words * rng.uniform(0.5, 1.5)))
+            if category == 'non':
+                words = sample_words(vocabulary, length, rng)
+            else:
+                start = rng.randint(0, max(1, source_words - length))
+                words = rewrite(source[start:start + length], category, vocabulary, rng)
+            rows.append(('g{}_task{}.txt'.format(answer, task_name), task_name, category, words))
+
+    for file, _, _, words in rows:
+        with open(os.path.join(directory, file), 'w') as text_file:
+            text_file.write(to_text(words, rng))
+
+    csv_file = os.path.join(directory, 'file_information.csv')
+    pd.DataFrame([row[:3] for row in rows], columns=['File', 'Task', 'Category']).to_csv(csv_file, index=False)
+    return csv_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a seeded synthetic plagiarism corpus')
+    parser.add_argument('directory', type=str)
+    parser.add_argument('--tasks', type=int, default=5)
+    parser.add_argument('--answers-per-task', type=int, default=19)
+    parser.add_argument('--source-words', type=int, default=500)
+    parser.add_argument('--answer-words', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('Corpus written to '+generate_corpus(args.directory, args.tasks, args.answers_per_task,
+                                               args.source_words, args.answer_words, args.seed))
@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARK_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+import helpers  # noqa: E402
+import corpus  # noqa: E402
+
+# Corpus sizes, arguments of corpus.generate_corpus
+SCALES = {
+    'small': {'tasks': 5, 'answers_per_task': 20, 'source_words': 500, 'answer_words': 300},
+    'medium': {'tasks': 20, 'answers_per_task': 50, 'source_words': 1500, 'answer_words': 800},
+    'large': {'tasks': 50, 'answers_per_task': 200, 'source_words': 3000, 'answer_words': 1500},
+}
+
+# Answers timed by the per pair references, their cost grows with the product of the text lengths
+SAMPLE = 20
+DP_SAMPLE = 5
+
+BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+
+# Best wall time of repeat calls
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_preprocess(csv_file, text_dir, work_dir):
+    # finished feature parts of an earlier run would be reused
+    shutil.rmtree(os.path.join(work_dir, 'work'), ignore_errors=True)
+    subprocess.run([sys.executable, os.path.join(SRC_DIR, 'preprocess.py'), '--force', '--csv-file', csv_file,
+                    '--text-dir', text_dir, '--work-dir', os.path.join(work_dir, 'work'),
+                    '--save-dir', os.path.join(work_dir, 'models')],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+# Time the helpers functions and the preprocess.py pipeline on one synthetic corpus
+def run_scale(scale, seed, repeat):
+    directory = tempfile.mkdtemp()
+    try:
+        csv_file = corpus.generate_corpus(os.path.join(directory, 'data'), seed=seed, **SCALES[scale])
+        text_dir = os.path.join(directory, 'data', '')
+
+        manifest = helpers.numerical_dataframe(csv_file)
+        df = helpers.create_text_column(manifest, text_dir)
+        lookup = helpers.create_lookup(df)
+        answers = [file for file, row in lookup['rows'].items() if row['Category'] > -1]
+        source_texts = {task: lookup['rows'][file]['Text'] for task, file in lookup['sources'].items()}
+        pairs = [(lookup['rows'][file]['Text'], source_texts[lookup['rows'][file]['Task']]) for file in answers]
+
+        benchmarks = {
+            'create_text_column': (lambda: helpers.create_text_column(manifest, text_dir), len(df)),
+            'train_test_dataframe': (lambda: helpers.train_test_dataframe(manifest, seed), len(df)),
+            'calculate_containment': (lambda: [helpers.calculate_containment(df, 5, file, lookup=lookup)
+                                               for file in answers[:SAMPLE]], min(SAMPLE, len(answers))),
+            'create_containment_features': (lambda: helpers.create_containment_features(df, 5, lookup=lookup),
+                                            len(answers)),
+            'create_containment_features_sparse': (
+                lambda: helpers.create_containment_features_sparse(df, 5, lookup=lookup), len(answers)),
+            'lcs_norm_word_dp': (lambda: [helpers.lcs_norm_word(answer, source, method='dp')
+                                          for answer, source in pairs[:DP_SAMPLE]], min(DP_SAMPLE, len(pairs))),
+            'lcs_norm_word': (lambda: [helpers.lcs_norm_word(answer, source) for answer, source in pairs],
+                              len(pairs)),
+            'create_features': (lambda: helpers.create_features(df, range(1, 7), lookup=lookup), len(answers)),
+            'preprocess': (lambda: run_preprocess(csv_file, text_dir, directory), len(df)),
+        }
+
+        results = {}
+        for name, (fn, items) in benchmarks.items():
+            # the helpers functions print a line per call
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = best_time(fn, repeat)
+            results[name] = {'seconds': seconds, 'items': items, 'us_per_item': seconds / items * 1e6}
+            print('{:>7} {:>36} {:>10.4f}s {:>12.1f}us/item'.format(scale, name, seconds,
+                                                                   results[name]['us_per_item']))
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+# Benchmarks slower than their baseline by more than the tolerance and the noise floor
+def regressions(results, baseline, tolerance, floor):
+    found = []
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            reference = baseline.get(scale, {}).get(name)
+            if reference is None or reference['items'] != result['items']:
+                continue
+            if result['seconds'] > reference['seconds'] * (1 + tolerance) + floor:
+                found.append('{} {}: {:.4f}s, baseline {:.4f}s'.format(
+                    scale, name, result['seconds'], reference['seconds']))
+    return found
+
+
+def main(args):
+    results = {}
+    for scale in args.scales:
+        results[scale] = run_scale(scale, args.seed, args.repeat)
+
+    report = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'machine': platform.machine(), 'processor': platform.processor(), 'seed': args.seed,
+                       'repeat': args.repeat, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('Results written to '+args.output)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('Baseline written to '+args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --update-baseline to store one'.format(args.baseline))
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+    found = regressions(results, baseline, args.tolerance, args.floor)
+    for line in found:
+        print('REGRESSION '+line)
+    if not found:
+        print('No regression against '+args.baseline)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the helpers functions and preprocess.py on synthetic corpora '
+                                                 'and fail on a regression against the stored baseline')
+    parser.add_argument('--scales', type=str, nargs='+', default=['small', 'medium'], choices=list(SCALES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest one counts')
+    parser.add_argument('--output', type=str, default=None, help='json file for the results')
+    parser.add_argument('--baseline', type=str, default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed slowdown against the baseline, 0.5 fails runs over 1.5x the baseline')
+    parser.add_argument('--floor', type=float, default=0.05,
+                        help='seconds of slowdown always tolerated, timer noise of the short benchmarks')
+    args = parser.parse_args()
+
+    sys.exit(main(args))
@@ -1,22 +1,35 @@
-import json 
+import json
 import os
 import io
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 import numpy as np
 import pandas as pd
 from sklearn.metrics import accuracy_score
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+import helpers  # noqa: E402
 
 ENDPOINT_NAME = os.environ.get('ENDPOINT_NAME')
-CONTENT_TYPE = 'application/python-pickle'
+# Local stand-in for the Sagemaker endpoint, ex. http://127.0.0.1:8080 of src/serve.py, used instead when set
+ENDPOINT_URL = os.environ.get('ENDPOINT_URL')
+# application/x-float32 (raw float32 with a shape header) or text/csv
+CONTENT_TYPE = os.environ.get('CONTENT_TYPE', 'application/x-float32')
 DATA_DIR = 'models'
 
+# Rows per request (0 sends all rows in one request) and requests sent at the same time
+CHUNK_ROWS = int(os.environ.get('CHUNK_ROWS', 1000))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 4))
+
+# Attempts after a failed request, waiting BACKOFF_SECONDS * 2^attempt with jitter in between
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 5))
+BACKOFF_SECONDS = float(os.environ.get('BACKOFF_SECONDS', 0.1))
 
-# Read in test data
-test_data = pd.read_csv(os.path.join(DATA_DIR, "test.csv"), header=None, names=None)
-test_y = test_data.iloc[:,0]
-test_x = test_data.iloc[:,1:]
 
 def np2csv(arr):
     csv = io.BytesIO()
@@ -24,21 +37,142 @@ def np2csv(arr):
     return csv.getvalue().decode().rstrip()
 
 
-payload = np2csv(test_x)
+def encode(x):
+    if CONTENT_TYPE == 'text/csv':
+        return np2csv(x)
+    return helpers.pack_float32(x)
+
+
+# Send a payload to the Sagemaker endpoint and return the response body
+def sagemaker_invoker(endpoint_name):
+    import boto3
+
+    client = boto3.client('sagemaker-runtime')
+
+    def invoke(payload):
+        response = client.invoke_endpoint(
+            EndpointName=endpoint_name,
+            ContentType=CONTENT_TYPE,
+            Accept='application/json',
+            Body=payload
+        )
+        return response['Body'].read()
+
+    return invoke
+
+
+# Send a payload to POST /invocations of a local server and return the response body
+def http_invoker(url, timeout=60):
+    url = url.rstrip('/') + '/invocations'
+
+    def invoke(payload):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        request = urllib.request.Request(url, data=payload, method='POST',
+                                         headers={'Content-Type': CONTENT_TYPE, 'Accept': 'application/json'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read()
+
+    return invoke
+
+
+# Error codes of botocore client errors that are throttling, sent with a 400 status but worth a retry
+THROTTLING_CODES = {'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded'}
+
+
+# Client errors of the local server (urllib HTTPError) or of Sagemaker (botocore ClientError) that
+# would fail the same way on every retry, ex. a ValidationError or a ModelError of the endpoint
+def is_client_error(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code < 500 and error.code != 429
+
+    # botocore is only imported with boto3, ClientError is recognized by its response dictionary
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    code = response.get('Error', {}).get('Code')
+    return status is not None and status < 500 and status != 429 and code not in THROTTLING_CODES
+
+
+def invoke_with_retry(invoke, payload, retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+    '''Sends a payload, retrying failed requests with exponential backoff.
+       Client errors other than throttling (429 or a throttling error code) are raised at once, a retry
+       would fail the same way. See is_client_error.
+       :param invoke: A function sending a payload and returning the response body
+       :param payload: The request body
+       :param retries: The number of retries after the first attempt
+       :param backoff: Seconds before the first retry, doubled for every further one
+       :return: The response body and the number of retries it took'''
+
+    for attempt in range(retries + 1):
+        try:
+            return invoke(payload), attempt
+        except Exception as error:
+            if is_client_error(error):
+                raise
+            if attempt == retries:
+                raise
+            # full jitter, clients retrying at the same moment would hit a busy endpoint together
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+
+def predict_chunks(invoke, x, chunk_rows=CHUNK_ROWS, max_in_flight=MAX_IN_FLIGHT):
+    '''Predicts a feature array in chunks of rows sent concurrently, the predictions come back in row order.
+       A chunk is only encoded when its request is sent, so at most max_in_flight payloads are held.
+       :param invoke: A function sending a payload and returning the response body
+       :param x: Data features
+       :param chunk_rows: The number of rows per request, 0 for all rows in one request
+       :param max_in_flight: The number of requests sent at the same time
+       :return: The predictions and a dictionary of 'rows', 'seconds', 'rows_per_second', request
+           'latencies' (seconds, in chunk order) and 'retries' '''
+
+    x = np.asarray(x)
+    chunk_rows = chunk_rows or max(len(x), 1)
+    starts = range(0, len(x), chunk_rows)
+
+    def send(start):
+        request_start = time.perf_counter()
+        body, retries = invoke_with_retry(invoke, encode(x[start:start + chunk_rows]))
+        return json.loads(body.decode('utf-8')), time.perf_counter() - request_start, retries
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        # map returns the results in the order of the chunks, whichever request finished first
+        results = list(executor.map(send, starts))
+    seconds = time.perf_counter() - start
+
+    predictions = [value for chunk, _, _ in results for value in chunk]
+    return predictions, {'rows': len(x), 'requests': len(results), 'seconds': seconds,
+                         'rows_per_second': len(x) / seconds if seconds > 0 else 0.0,
+                         'latencies': [latency for _, latency, _ in results],
+                         'retries': sum(retries for _, _, retries in results)}
+
+
+def print_stats(stats):
+    latencies = np.array(stats['latencies']) * 1000
+    print('{} rows in {} requests, {:.3f}s, {:.0f} rows/s, latency p50 {:.1f}ms p99 {:.1f}ms, {} retries'.format(
+        stats['rows'], stats['requests'], stats['seconds'], stats['rows_per_second'],
+        np.percentile(latencies, 50) if len(latencies) else 0.0,
+        np.percentile(latencies, 99) if len(latencies) else 0.0, stats['retries']))
+
 
-client = boto3.client('sagemaker-runtime')
-response = client.invoke_endpoint(
-    EndpointName=ENDPOINT_NAME,
-    ContentType='text/csv',
-    Body=payload
-)
+if __name__ == '__main__':
+    # Read in test data, test.npy or test.csv
+    test_x, test_y = helpers.load_data(DATA_DIR, 'test', os.environ.get('DATA_FORMAT', 'auto'))
+    test_y = pd.Series(np.asarray(test_y).astype(int))
 
+    if ENDPOINT_URL:
+        invoke = http_invoker(ENDPOINT_URL)
+    else:
+        invoke = sagemaker_invoker(ENDPOINT_NAME)
 
-test_y_preds = json.loads(response['Body'].read().decode('utf-8'))
-print('Accuracy Score: ', accuracy_score(test_y, test_y_preds))
+    test_y_preds, stats = predict_chunks(invoke, test_x)
+    print_stats(stats)
+    print('Accuracy Score: ', accuracy_score(test_y, test_y_preds))
 
-## print out the array of predicted and true labels, if you want
-print('\nPredicted class labels: ')
-print(test_y_preds)
-print('\nTrue class labels: ')
-print(test_y.values)
+    ## print out the array of predicted and true labels, if you want
+    print('\nPredicted class labels: ')
+    print(test_y_preds)
+    print('\nTrue class labels: ')
+    print(test_y.values)
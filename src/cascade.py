@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import helpers
+
+# Features too expensive for the first stage, computed only for the answers it is not confident about
+EXPENSIVE_FEATURES = ['lcs_word']
+
+# Confidence thresholds of the accuracy and latency report
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+
+def create_cascade(x, y, features, threshold=0.9, C=10.0):
+    '''Trains the first stage of a cascade: a logistic regression on the cheap containment features
+       whose probability decides an answer when it reaches the threshold. The other answers are
+       left to the full model with all features, ex. the SVC of model.joblib.
+       :param x: Data features, the columns of features
+       :param y: Data labels
+       :param features: The feature names of the columns, ex. ['c_1', 'c_5', 'lcs_word']
+       :param threshold: The class probability the first stage needs to decide an answer
+       :param C: The inverse regularization strength of the logistic regression
+       :return: A dictionary with the logistic regression 'coef', 'intercept' and 'classes', its 'features'
+           and the 'threshold' '''
+
+    cheap = [feature for feature in features if feature not in EXPENSIVE_FEATURES]
+    if not cheap or len(cheap) == len(features):
+        raise ValueError('A cascade needs cheap and expensive features, got {}'.format(features))
+
+    columns = [features.index(feature) for feature in cheap]
+    model = LogisticRegression(C=C).fit(np.asarray(x)[:, columns], y)
+    if len(model.classes_) != 2:
+        raise ValueError('A cascade needs two classes, got {}'.format(model.classes_))
+
+    # kept as arrays, the input validation of predict_proba costs more than the features of a short answer
+    return {'coef': model.coef_[0].copy(), 'intercept': float(model.intercept_[0]), 'classes': model.classes_.copy(),
+            'features': cheap, 'threshold': threshold}
+
+
+# Splits rows into the ones the first stage decides and the ones left to the full model
+def first_stage(cascade, cheap_x, threshold=None):
+    threshold = cascade['threshold'] if threshold is None else threshold
+    probability = 1.0 / (1.0 + np.exp(-(np.dot(cheap_x, cascade['coef']) + cascade['intercept'])))
+    prediction = cascade['classes'][(probability >= 0.5).astype(int)]
+    return prediction, np.maximum(probability, 1.0 - probability) >= threshold
+
+
+def predict_features(cascade, full_model, x, features, threshold=None):
+    '''Predicts precomputed feature rows with the cascade, the accuracy of the cascade without its savings.
+       :param cascade: The cascade from create_cascade
+       :param full_model: The model trained on all features
+       :param x: Data features, the columns of features
+       :param features: The feature names of the columns
+       :param threshold: Optional threshold overriding the one of the cascade
+       :return: The predictions and a mask of the rows the first stage decided'''
+
+    x = np.asarray(x)
+    prediction, decided = first_stage(cascade, x[:, [features.index(f) for f in cascade['features']]], threshold)
+    if not decided.all():
+        prediction[~decided] = full_model.predict(x[~decided])
+    return prediction, decided
+
+
+def predict_answers(cascade, full_model, answers, sources, threshold=None):
+    '''Predicts answer texts with the cascade, the expensive features are only computed for the
+       answers the first stage is not confident about.
+       :param cascade: The cascade from create_cascade
+       :param full_model: The model trained on all source profile features
+       :param answers: A list of (pre-processed answer text, source profile) pairs
+       :param sources: The source profiles from helpers.create_source_profiles
+       :param threshold: Optional threshold overriding the one of the cascade
+       :return: The predictions and a mask of the answers the first stage decided'''
+
+    ngram_range = sources['ngram_range']
+    cheap_x = np.array([helpers.profile_features(text, source, cascade['features'], ngram_range)
+                        for text, source in answers], dtype=float).reshape(len(answers), -1)
+    # answers shorter than n words share no ngram of size n with their source
+    cheap_x = np.nan_to_num(cheap_x, nan=0.0)
+    prediction, decided = first_stage(cascade, cheap_x, threshold)
+
+    deferred = np.flatnonzero(~decided)
+    if len(deferred):
+        cheap_values = dict(zip(cascade['features'], cheap_x[deferred].T))
+        expensive = [feature for feature in sources['features'] if feature not in cheap_values]
+        expensive_values = dict(zip(expensive, np.array(
+            [helpers.profile_features(answers[i][0], answers[i][1], expensive, ngram_range) for i in deferred],
+            dtype=float).T))
+        full_x = np.column_stack([cheap_values.get(feature, expensive_values.get(feature))
+                                  for feature in sources['features']])
+        prediction[deferred] = full_model.predict(np.nan_to_num(full_x, nan=0.0))
+
+    return prediction, decided
+
+
+# Best time of predicting every answer on its own, as the endpoint receives them
+def time_per_answer(predict, answers, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for answer in answers:
+            predict([answer])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(answers)
+
+
+def evaluate(cascade, full_model, answers, y, sources, thresholds=None, repeat=3):
+    '''Measures accuracy and per answer latency of the full model and of the cascade at every threshold.
+       :param cascade: The cascade from create_cascade
+       :param full_model: The model trained on all source profile features
+       :param answers: A list of (pre-processed answer text, source profile) pairs
+       :param y: The labels of the answers
+       :param sources: The source profiles from helpers.create_source_profiles
+       :param thresholds: The thresholds to report, defaults to THRESHOLDS
+       :param repeat: Timed runs per configuration, the fastest one counts
+       :return: A list of dictionaries with the 'threshold' (None for the full model), 'accuracy',
+           share of answers 'decided' by the first stage and 'ms_per_answer' '''
+
+    y = np.asarray(y)
+    thresholds = THRESHOLDS if thresholds is None else thresholds
+
+    def predict_full(batch):
+        x = [helpers.profile_features(text, source, sources['features'], sources['ngram_range'])
+             for text, source in batch]
+        return full_model.predict(np.nan_to_num(np.array(x, dtype=float), nan=0.0))
+
+    rows = [{'threshold': None, 'accuracy': float(np.mean(predict_full(answers) == y)), 'decided': 0.0,
+             'ms_per_answer': time_per_answer(predict_full, answers, repeat) * 1000}]
+    for threshold in thresholds:
+        prediction, decided = predict_answers(cascade, full_model, answers, sources, threshold)
+        seconds = time_per_answer(lambda batch: predict_answers(cascade, full_model, batch, sources, threshold),
+                                  answers, repeat)
+        rows.append({'threshold': threshold, 'accuracy': float(np.mean(prediction == y)),
+                     'decided': float(decided.mean()), 'ms_per_answer': seconds * 1000})
+    return rows
+
+
+# Reads the test answers listed in the answers.npy sidecar with their texts and source profiles
+def test_answers(data_dir, text_dir, sources):
+    x, y = helpers.load_npy(os.path.join(data_dir, 'answers.npy'))
+    sidecar = helpers.load_sidecar(os.path.join(data_dir, 'answers.npy'))
+
+    answers, labels = [], []
+    for i, (file, task) in enumerate(zip(sidecar['file'], sidecar['task'])):
+        if sidecar['datatype'][i] != 'test':
+            continue
+        with open(os.path.join(text_dir, file), 'r', encoding='utf-8', errors='ignore') as text_file:
+            answers.append((helpers.normalize_text(text_file.read()), sources['sources'][task]))
+        labels.append(y[i])
+    return answers, np.array(labels)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accuracy and latency of the cascade on the test answers')
+    parser.add_argument('--model-dir', type=str, default='models',
+                        help='directory of model.joblib, sources.joblib and cascade.joblib')
+    parser.add_argument('--data-dir', type=str, default='models', help='directory of answers.npy')
+    parser.add_argument('--text-dir', type=str, default='data', help='directory of the answer texts')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=THRESHOLDS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None,
+                        help='json file for the report, defaults to cascade_report.json in the model dir')
+    args = parser.parse_args()
+
+    cascade_path = os.path.join(args.model_dir, 'cascade.joblib')
+    if not os.path.exists(cascade_path):
+        sys.exit('No cascade in {}, train one with train.py --cascade'.format(args.model_dir))
+    cascade = joblib.load(cascade_path)
+    full_model = joblib.load(os.path.join(args.model_dir, 'model.joblib'))
+    sources = joblib.load(os.path.join(args.model_dir, 'sources.joblib'))
+
+    answers, y = test_answers(args.data_dir, args.text_dir, sources)
+    rows = evaluate(cascade, full_model, answers, y, sources, args.thresholds, args.repeat)
+
+    print('{:>9} {:>9} {:>8} {:>14}'.format('threshold', 'accuracy', 'decided', 'ms per answer'))
+    for row in rows:
+        print('{:>9} {:>9.4f} {:>8.2f} {:>14.3f}'.format('full' if row['threshold'] is None else row['threshold'],
+                                                       row['accuracy'], row['decided'], row['ms_per_answer']))
+
+    output = args.output or os.path.join(args.model_dir, 'cascade_report.json')
+    with open(output, 'w') as file:
+        json.dump({'answers': len(answers), 'cascade_threshold': cascade['threshold'], 'rows': rows}, file, indent=2)
+    print('Cascade report written to '+output)
@@ -0,0 +1,182 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+import helpers
+import instrument
+
+
+# Columns of the hashed ngram matrix, a pair of answers shares a bucket by chance once in about 2^24 ngram pairs
+HASH_FEATURES = 2 ** 24
+
+
+# Binary ngram matrix of the answers of one task, built a chunk of texts at a time
+def ngram_matrix(chunks, n, source_text=None):
+    '''Builds a sparse answers x hashed ngrams matrix with a 1 for every ngram an answer contains.
+       The ngrams are hashed instead of counted into a vocabulary, so the texts of a chunk can be
+       dropped once it is transformed; the exact features of the candidate pairs are computed later.
+       :param chunks: An iterable of lists of pre-processed answer texts
+       :param n: An integer that defines the ngram size
+       :param source_text: Optional source text, its ngrams are dropped so answers that both copy
+           the source are not taken for copies of each other
+       :return: A CSR matrix, None when there are no answers'''
+
+    vectorizer = HashingVectorizer(analyzer='word', ngram_range=(n, n), n_features=HASH_FEATURES, binary=True,
+                                   norm=None, alternate_sign=False, dtype=np.float64)
+    blocks = [vectorizer.transform(texts) for texts in chunks]
+    if not blocks:
+        return None
+    matrix = sparse.vstack(blocks, format='csr')
+
+    if source_text is not None:
+        in_source = np.zeros(HASH_FEATURES, dtype=bool)
+        in_source[vectorizer.transform([source_text]).indices] = True
+        matrix.data[in_source[matrix.indices]] = 0
+        matrix.eliminate_zeros()
+    return matrix
+
+
+# Texts of the answers of one task in chunks, from the Text column or read from the files
+def iter_task_texts(task_df, file_directory=None, chunk_size=1000):
+    if 'Text' in task_df:
+        texts = list(task_df['Text'])
+        for start in range(0, len(texts), chunk_size):
+            yield texts[start:start + chunk_size]
+        return
+
+    for chunk in helpers.iter_text_records(task_df, file_directory, chunk_size):
+        yield [text for _, _, text in chunk]
+
+
+@instrument.timed()
+def candidate_pairs(matrix, threshold, min_shared=5, block_size=1000):
+    '''Finds the answer pairs that share at least a threshold of the ngrams of the shorter answer,
+       from the sparse product of the matrix with its transpose, a block of rows at a time.
+       Only answers that share an ngram are ever compared, unlike a loop over all pairs.
+       :param matrix: A binary answers x ngrams matrix from ngram_matrix
+       :param threshold: The minimum share of the ngrams of the shorter answer found in the other one
+       :param min_shared: The minimum number of shared ngrams, a few common phrases are no copy
+       :param block_size: The number of rows multiplied at a time, bounds the memory of the product
+       :return: Arrays of the first rows, the second rows (always greater), the shared ngram counts
+           and the shares'''
+
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    # a CSR right operand, a CSC one would be converted again by every block product
+    transposed = matrix.T.tocsr()
+
+    found = []
+    for start in range(0, matrix.shape[0], block_size):
+        overlap = (matrix[start:start + block_size] @ transposed).tocoo()
+        rows = overlap.row + start
+        # every pair once, without an answer paired with itself
+        upper = overlap.col > rows
+        rows, cols, shared = rows[upper], overlap.col[upper], overlap.data[upper].astype(int)
+
+        share = shared / np.minimum(totals[rows], totals[cols])
+        keep = (share >= threshold) & (shared >= min_shared)
+        found.append((rows[keep], cols[keep], shared[keep], share[keep]))
+
+    if not found:
+        return tuple(np.empty(0, dtype=dtype) for dtype in (int, int, int, float))
+    return tuple(np.concatenate(arrays) for arrays in zip(*found))
+
+
+# The features of create_features for a pair of answers, the shorter one scored against the longer one
+def pair_features(text_a, text_b, ngram_range, lcs_method='bitparallel'):
+    if len(text_a.split()) > len(text_b.split()):
+        text_a, text_b = text_b, text_a
+
+    profile_a = helpers.ngram_profile(text_a, ngram_range)
+    profile_b = helpers.ngram_profile(text_b, ngram_range)
+    values = [helpers.profile_containment(profile_a, profile_b, n) for n in ngram_range]
+    if lcs_method is not None:
+        values.append(helpers.lcs_norm_word(text_a, text_b, method=lcs_method))
+    return values
+
+
+@instrument.timed()
+def detect_collusion(df, n=5, threshold=0.2, min_shared=5, ngram_range=(1, 5), lcs_method='bitparallel',
+                     exclude_source=True, block_size=1000, file_directory=None, chunk_size=1000):
+    '''Finds answers of the same task that copy each other. Candidate pairs are blocked by the share
+       of ngrams they have in common, only those get the full containment and LCS features.
+       Without a 'Text' column the texts are read from file_directory a chunk at a time, only the
+       ngram matrix of one task and the texts of its candidate pairs are kept in memory.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and optionally 'Text'
+       :param n: The ngram size of the blocking
+       :param threshold: The minimum share of the ngrams of the shorter answer found in the other one
+       :param min_shared: The minimum number of shared ngrams of a candidate pair
+       :param ngram_range: The ngram sizes of the containment features of a candidate pair
+       :param lcs_method: An LCS backend from helpers.LCS_METHODS, or None to skip the lcs feature
+       :param exclude_source: Ignore ngrams of the task source, answers copying the source are not flagged
+       :param block_size: The number of answers multiplied at a time, see candidate_pairs
+       :param file_directory: The directory of the text files, when df has no 'Text' column
+       :param chunk_size: The number of files read at a time
+       :return: A dataframe with a row per candidate pair: 'Task', 'File_a', 'File_b', the 'shared'
+           ngram count, the blocking 'share' and the features 'c_<n>' and 'lcs_word' '''
+
+    ngram_range = list(ngram_range)
+    columns = ['c_'+str(size) for size in ngram_range] + (['lcs_word'] if lcs_method is not None else [])
+    # source texts have Category = -1
+    sources = df[df['Category'] == -1]
+    source_files = dict(zip(sources['Task'], sources['File']))
+    source_texts = dict(zip(sources['Task'], sources['Text'])) if 'Text' in df else {}
+
+    pairs = []
+    for task, task_df in df[df['Category'] > -1].groupby('Task', sort=True):
+        files = list(task_df['File'])
+        source_text = None
+        if exclude_source and task in source_files:
+            if task in source_texts:
+                source_text = source_texts[task]
+            else:
+                source_text = helpers.read_text(file_directory + source_files[task])
+
+        matrix = ngram_matrix(iter_task_texts(task_df, file_directory, chunk_size), n, source_text)
+        if matrix is None:
+            continue
+        first, second, shared, share = candidate_pairs(matrix, threshold, min_shared, block_size)
+        instrument.count('collusion_pairs', len(files) * (len(files) - 1) // 2)
+        instrument.count('collusion_candidates', len(first))
+
+        # only the texts of candidate pairs are read again
+        if 'Text' in task_df:
+            texts = dict(enumerate(task_df['Text']))
+        else:
+            texts = {i: helpers.read_text(file_directory + files[i]) for i in set(first.tolist() + second.tolist())}
+        for i, j, shared_count, pair_share in zip(first.tolist(), second.tolist(), shared.tolist(), share.tolist()):
+            pairs.append([task, files[i], files[j], shared_count, pair_share]
+                         + pair_features(texts[i], texts[j], ngram_range, lcs_method))
+        print('Task {}: {} answers, {} candidate pairs'.format(task, len(files), len(first)))
+
+    result = pd.DataFrame(pairs, columns=['Task', 'File_a', 'File_b', 'shared', 'share'] + columns)
+    return result.sort_values('share', ascending=False, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find answers of the same task that copy each other')
+    parser.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    parser.add_argument('--text-dir', type=str, default='data/')
+    parser.add_argument('--n', type=int, default=5, help='ngram size of the candidate blocking')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='share of the ngrams of the shorter answer the other one needs to contain')
+    parser.add_argument('--min-shared', type=int, default=5, help='ngrams a candidate pair needs to share')
+    parser.add_argument('--ngrams', type=int, nargs='+', default=[1, 5], help='ngram sizes of the pair features')
+    parser.add_argument('--lcs-method', type=str, default='bitparallel', choices=list(helpers.LCS_METHODS))
+    parser.add_argument('--keep-source-ngrams', action='store_true',
+                        help='also count ngrams of the task source, flags answers that copy the same passage')
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=1000, help='text files read at a time')
+    parser.add_argument('--output', type=str, default='collusion.csv')
+    args = parser.parse_args()
+
+    # the texts are streamed from the text directory, never loaded all at once
+    df = helpers.numerical_dataframe(args.csv_file)
+    result = detect_collusion(df, args.n, args.threshold, args.min_shared, args.ngrams, args.lcs_method,
+                              exclude_source=not args.keep_source_ngrams, block_size=args.block_size,
+                              file_directory=os.path.join(args.text_dir, ''), chunk_size=args.chunk_size)
+    result.to_csv(args.output, index=False)
+    print('{} candidate pairs written to {}'.format(len(result), args.output))
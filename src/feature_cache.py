@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# Default location of the cache and its size bound in feature values
+CACHE_PATH = 'cache/features.sqlite'
+MAX_ENTRIES = 5000000
+
+# sqlite limits the number of bound variables per statement
+_BATCH = 500
+
+
+# Open (and create if needed) a persistent feature cache
+def open_cache(path=CACHE_PATH, max_entries=MAX_ENTRIES):
+    '''Opens an on-disk feature cache backed by sqlite.
+       :param path: The file the cache is stored in
+       :param max_entries: The number of feature values kept, least recently used values are evicted
+       :return: A cache dictionary to pass to the feature functions'''
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS features '
+               '(key TEXT PRIMARY KEY, feature TEXT, version INTEGER, value REAL, last_used REAL)')
+    db.execute('CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used)')
+    db.commit()
+
+    return {'db': db, 'path': path, 'max_entries': max_entries, 'hits': 0, 'misses': 0}
+
+
+def close_cache(cache):
+    cache['db'].close()
+
+
+# Content address of a text
+def text_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# Cache key of one feature value, changes with either text, the feature or the feature code version
+def feature_key(answer_digest, source_digest, feature, version):
+    return hashlib.sha256('{}\0{}\0{}\0{}'.format(version, feature, answer_digest, source_digest)
+                          .encode('utf-8')).hexdigest()
+
+
+def _get_many(cache, keys):
+    found = {}
+    now = time.time()
+    for i in range(0, len(keys), _BATCH):
+        batch = keys[i:i + _BATCH]
+        marks = ','.join('?' * len(batch))
+        rows = cache['db'].execute('SELECT key, value FROM features WHERE key IN (' + marks + ')', batch)
+        for key, value in rows:
+            # sqlite stores nan as NULL
+            found[key] = np.nan if value is None else value
+        cache['db'].execute('UPDATE features SET last_used = ? WHERE key IN (' + marks + ')', [now] + batch)
+
+    return found
+
+
+def _put_many(cache, rows):
+    now = time.time()
+    cache['db'].executemany('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)',
+                            [(key, feature, version, value, now) for key, feature, version, value in rows])
+    evict(cache)
+    cache['db'].commit()
+
+
+# Drop the least recently used values above max_entries
+def evict(cache):
+    count = cache['db'].execute('SELECT COUNT(*) FROM features').fetchone()[0]
+    excess = count - cache['max_entries']
+    if excess > 0:
+        cache['db'].execute('DELETE FROM features WHERE key IN '
+                            '(SELECT key FROM features ORDER BY last_used LIMIT ?)', (excess,))
+
+
+# Look up the features of (task, answer text) pairs and compute only the missing ones
+def cached_features(cache, answers, source_texts, columns, compute, version):
+    '''Returns feature values for answers from the cache, calling compute for the answers that miss.
+       :param cache: A cache from open_cache
+       :param answers: A list of (task, answer text) pairs
+       :param source_texts: A dictionary mapping each task to its source text
+       :param columns: The feature names computed for every answer, ex. ['c_1', 'lcs_word']
+       :param compute: A function mapping a list of answers to a list of value lists, in order
+       :param version: The feature code version, part of every key
+       :return: A list with the list of values of each answer, in order'''
+
+    source_digests = {task: text_digest(text) for task, text in source_texts.items()}
+    keys = []
+    for task, answer_text in answers:
+        answer_digest = text_digest(answer_text)
+        keys.append([feature_key(answer_digest, source_digests[task], column, version) for column in columns])
+
+    found = _get_many(cache, [key for answer_keys in keys for key in answer_keys])
+
+    values = [None] * len(answers)
+    missing = []
+    for i, answer_keys in enumerate(keys):
+        if all(key in found for key in answer_keys):
+            values[i] = [found[key] for key in answer_keys]
+        else:
+            missing.append(i)
+
+    cache['hits'] += len(answers) - len(missing)
+    cache['misses'] += len(missing)
+
+    rows = []
+    for i, answer_values in zip(missing, compute([answers[i] for i in missing])):
+        values[i] = answer_values
+        rows.extend(zip(keys[i], columns, [version] * len(columns), answer_values))
+    _put_many(cache, rows)
+
+    return values
+
+
+# Delete cached values, all of them or only those of a feature or of old feature code versions
+def invalidate(cache, feature=None, before_version=None):
+    '''Removes values from the cache.
+       :param cache: A cache from open_cache
+       :param feature: Only remove values of this feature, ex. 'lcs_word'
+       :param before_version: Only remove values computed by feature code older than this version
+       :return: The number of values removed'''
+
+    conditions = []
+    params = []
+    if feature is not None:
+        conditions.append('feature = ?')
+        params.append(feature)
+    if before_version is not None:
+        conditions.append('version < ?')
+        params.append(before_version)
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    removed = cache['db'].execute('DELETE FROM features' + where, params).rowcount
+    cache['db'].commit()
+    cache['db'].execute('VACUUM')
+
+    return removed
+
+
+def cache_stats(cache):
+    counts = cache['db'].execute('SELECT feature, version, COUNT(*) FROM features GROUP BY feature, version')
+    return {'path': cache['path'], 'max_entries': cache['max_entries'],
+            'entries': [{'feature': feature, 'version': version, 'count': count}
+                        for feature, version, count in counts]}
+
+
+if __name__ == '__main__':
+    import helpers
+
+    parser = argparse.ArgumentParser(description='Inspect or invalidate the on-disk feature cache')
+    parser.add_argument('command', choices=['invalidate', 'prune', 'stats'],
+                        help='invalidate: remove values, prune: remove values of old feature code versions')
+    parser.add_argument('--cache', type=str, default=os.environ.get('FEATURE_CACHE', CACHE_PATH))
+    parser.add_argument('--feature', type=str, default=None, help='only invalidate this feature, ex. lcs_word')
+    args = parser.parse_args()
+
+    cache = open_cache(args.cache)
+    if args.command == 'invalidate':
+        print('Removed {} cached values'.format(invalidate(cache, feature=args.feature)))
+    elif args.command == 'prune':
+        print('Removed {} cached values'.format(invalidate(cache, before_version=helpers.FEATURE_VERSION)))
+    else:
+        print(cache_stats(cache))
+    close_cache(cache)
@@ -1,11 +1,21 @@
+import contextlib
+import json
 import operator
 import os
 import re
+import string
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
 
 import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer
 
+import feature_cache
+import instrument
+
 # Add 'datatype' column that indicates if the record is original wiki answer as 0, training data 1, test data 2, onto
 # the dataframe - uses stratified random sampling (with seed) to sample by task & plagiarism amount
 
@@ -16,42 +26,32 @@ def create_datatype(df, train_value, test_value, datatype_var, compare_dfcolumn,
                     sampling_number, sampling_seed):
     # Subsets dataframe by condition relating to statement built from:
     # 'compare_dfcolumn' 'operator_of_compare' 'value_of_compare'
-    df_subset = df[operator_of_compare(df[compare_dfcolumn], value_of_compare)]
-    df_subset = df_subset.drop(columns=[datatype_var])
-
-    # Prints counts by task and compare_dfcolumn for subset df
-    #print("\nCounts by Task & " + compare_dfcolumn + ":\n", df_subset.groupby(['Task', compare_dfcolumn]).size().reset_index(name="Counts") )
-
-    # Sets all datatype to value for training for df_subset
-    df_subset.loc[:, datatype_var] = train_value
-
-    # Performs stratified random sample of subset dataframe to create new df with subset values
-    df_sampled = df_subset.groupby(['Task', compare_dfcolumn], group_keys=False).apply(
-        lambda x: x.sample(min(len(x), sampling_number), random_state=sampling_seed))
-    df_sampled = df_sampled.drop(columns=[datatype_var])
-    # Sets all datatype to value for test_value for df_sampled
-    df_sampled.loc[:, datatype_var] = test_value
-
-    # Prints counts by compare_dfcolumn for selected sample
-    #print("\nCounts by "+ compare_dfcolumn + ":\n", df_sampled.groupby([compare_dfcolumn]).size().reset_index(name="Counts") )
-    #print("\nSampled DF:\n",df_sampled)
-
-    # Labels all datatype_var column as train_value which will be overwritten to
-    # test_value in next for loop for all test cases chosen with stratified sample
-    for index in df_sampled.index:
-        # Labels all datatype_var columns with test_value for straified test sample
-        df_subset.loc[index, datatype_var] = test_value
-
-    #print("\nSubset DF:\n",df_subset)
-    # Adds test_value and train_value for all relevant data in main dataframe
-    for index in df_subset.index:
-        # Labels all datatype_var columns in df with train_value/test_value based upon
-        # stratified test sample and subset of df
-        df.loc[index, datatype_var] = df_subset.loc[index, datatype_var]
+    in_subset = np.asarray(operator_of_compare(df[compare_dfcolumn], value_of_compare), dtype=bool)
+    df_subset = df.loc[in_subset, ['Task', compare_dfcolumn]]
+
+    # Position of every row within its (Task, compare_dfcolumn) group and the size of that group
+    groups = df_subset.groupby(['Task', compare_dfcolumn], sort=False)
+    position = groups.cumcount().to_numpy()
+    group_id = groups.ngroup().to_numpy()
+    group_size = np.bincount(group_id)[group_id]
+
+    # Performs stratified random sample of the subset: x.sample(k, random_state=seed) picks the first k
+    # positions of RandomState(seed).permutation(len(x)), which is the same for all groups of one size,
+    # so sampling needs one permutation per distinct group size instead of one call per group
+    is_test = np.zeros(len(df_subset), dtype=bool)
+    for size in np.unique(group_size):
+        sampled = np.zeros(size, dtype=bool)
+        sampled[np.random.RandomState(sampling_seed).permutation(size)[:min(size, sampling_number)]] = True
+        in_size = group_size == size
+        is_test[in_size] = sampled[position[in_size]]
+
+    # Labels the subset as train_value, or test_value for the stratified test sample
+    df.loc[in_subset, datatype_var] = np.where(is_test, test_value, train_value)
 
     # returns nothing because dataframe df already altered
 
 
+@instrument.timed()
 def train_test_dataframe(clean_df, random_seed=100):
 
     new_df = clean_df.copy()
@@ -70,32 +70,82 @@ def train_test_dataframe(clean_df, random_seed=100):
     # creating a dictionary of categorical:numerical mappings for plagiarsm categories
     mapping = {0: 'orig', 1: 'train', 2: 'test'}
 
-    # traversing through dataframe and replacing categorical data
-    new_df.Datatype = [mapping[item] for item in new_df.Datatype]
+    # replacing categorical data
+    new_df['Datatype'] = new_df['Datatype'].map(mapping)
 
     return new_df
 
 
+# Byte table that keeps ascii letters and digits and turns every other byte into a space
+NORMALIZE_TABLE = bytes(c if chr(c) in string.ascii_letters + string.digits else ord(' ') for c in range(256))
+
+# Runs of spaces the legacy re.sub("  ")/re.sub("   ") passes only partly collapsed
+SPACE_RUN_PATTERN = re.compile(' {2,}')
+
+
+def _compat_space_run(match):
+    # "  " -> " " halves a run (rounding up), then "   " -> " " replaces every full triple
+    half = (len(match.group()) + 1) // 2
+    return ' ' * (half // 3 + half % 3)
+
+
+# helper function for standardizing a text in a single pass
+def normalize_text(text, compat=False):
+    '''Lower cases a text, maps every non-alphanumeric character to a space and collapses whitespace.
+       :param text: The raw text
+       :param compat: If True, reproduce the spacing of the legacy five pass re.sub normalization
+           exactly instead of collapsing every whitespace run to one space, tokens are the same either way
+       :return: The standardized text'''
+
+    # non ascii characters become a single '?' and then a space like any other non-alphanumeric
+    all_text = text.lower().encode('ascii', 'replace').translate(NORMALIZE_TABLE).decode('ascii')
+
+    if compat:
+        return SPACE_RUN_PATTERN.sub(_compat_space_run, all_text)
+
+    return ' '.join(all_text.split())
+
+
 # helper function for pre-processing text given a file
-def process_file(file):
-    # put text in all lower case letters
-    all_text = file.read().lower()
+def process_file(file, compat=False):
+    return normalize_text(file.read(), compat=compat)
 
-    # remove all non-alphanumeric chars
-    all_text = re.sub(r"[^a-zA-Z0-9]", " ", all_text)
-    # remove newlines/tabs, etc. so it's easier to match phrases, later
-    all_text = re.sub(r"\t", " ", all_text)
-    all_text = re.sub(r"\n", " ", all_text)
-    all_text = re.sub("  ", " ", all_text)
-    all_text = re.sub("   ", " ", all_text)
 
-    return all_text
+# Read in and standardize the text of a single file
+def read_text(file_path, compat=False):
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+        return process_file(file, compat=compat)
 
 
-def create_text_column(df, file_directory='data/'):
+# Generator over the files listed in a df, only one chunk of texts is held in memory at a time
+def iter_text_records(df, file_directory='data/', chunk_size=1000, compat=False):
+    '''Reads in the files listed in a df lazily, in row order.
+       :param df: A dataframe of file information including columns for `File` and `Task`
+       :param file_directory: the main directory where files are stored
+       :param chunk_size: The maximum number of records per chunk
+       :param compat: Use the legacy spacing of normalize_text
+       :return: Yields lists of up to chunk_size (File, Task, Text) records with processed text'''
+
+    chunk = []
+    for filename, task in zip(df['File'], df['Task']):
+        chunk.append((filename, task, read_text(file_directory + filename, compat=compat)))
+        if instrument.enabled():
+            instrument.count('documents_read')
+            instrument.count('tokens_read', len(chunk[-1][2].split()))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+@instrument.timed()
+def create_text_column(df, file_directory='data/', compat=False):
     '''Reads in the files, listed in a df and returns that df with an additional column, `Text`. 
        :param df: A dataframe of file information including a column for `File`
        :param file_directory: the main directory where files are stored
+       :param compat: Use the legacy spacing of normalize_text
        :return: A dataframe with processed text '''
 
     # create copy to modify
@@ -105,16 +155,8 @@ def create_text_column(df, file_directory='data/'):
     text = []
 
     # for each file (row) in the df, read in the file
-    for row_i in df.index:
-        filename = df.iloc[row_i]['File']
-        # print(filename)
-        file_path = file_directory + filename
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-
-            # standardize text using helper function
-            file_text = process_file(file)
-            # append processed text to list
-            text.append(file_text)
+    for chunk in iter_text_records(df, file_directory, compat=compat):
+        text.extend(file_text for _, _, file_text in chunk)
 
     # add column to the copied dataframe
     text_df['Text'] = text
@@ -145,8 +187,26 @@ def numerical_dataframe(csv_file):
     return numerical_df
 
 
+# Build O(1) lookups from file name to row and from task to source text
+def create_lookup(df):
+    '''Indexes a dataframe once so feature functions don't have to filter it for every answer.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and 'Text'
+       :return: A dictionary with 'rows', mapping each file name to its 'Task', 'Category'
+           and 'Text', and 'sources', mapping each task to the file name of its source text'''
+
+    rows = {}
+    sources = {}
+    for file, task, category, text in zip(df['File'], df['Task'], df['Category'], df['Text']):
+        rows[file] = {'Task': task, 'Category': category, 'Text': text}
+        # source texts have Category = -1
+        if category == -1:
+            sources[task] = file
+
+    return {'rows': rows, 'sources': sources}
+
+
 # Calculate the ngram containment for one answer file/source file pair in a df
-def calculate_containment(df, n, answer_filename):
+def calculate_containment(df, n, answer_filename, lookup=None):
     '''Calculates the containment between a given answer text and its associated source text.
        This function creates a count of ngrams (of a size, n) for each text file in our data.
        Then calculates the containment by finding the ngram count for a given answer text, 
@@ -155,15 +215,17 @@ def calculate_containment(df, n, answer_filename):
            'File', 'Task', 'Category', 'Class', 'Text', and 'Datatype'
        :param n: An integer that defines the ngram size
        :param answer_filename: A filename for an answer text in the df, ex. 'g0pB_taskd.txt'
+       :param lookup: Optional prebuilt lookup from create_lookup(df)
        :return: A single containment value that represents the similarity
            between an answer text and its source text.
     '''
 
-    a_text = df[df.File == answer_filename]['Text'].values[0]
-    a_tasktype = df[df.File == answer_filename]['Task'].values[0]
+    if lookup is None:
+        lookup = create_lookup(df)
 
-    s_text = df[(df.Category == -1) &
-                (df.Task == a_tasktype)]['Text'].values[0]
+    answer_row = lookup['rows'][answer_filename]
+    a_text = answer_row['Text']
+    s_text = lookup['rows'][lookup['sources'][answer_row['Task']]]['Text']
 
     counts = CountVectorizer(analyzer='word', ngram_range=(n, n))
     arr_ngram = counts.fit_transform([a_text, s_text]).toarray()
@@ -171,8 +233,70 @@ def calculate_containment(df, n, answer_filename):
     return sum(np.minimum(arr_ngram[0], arr_ngram[1]))/sum(arr_ngram[0])
 
 
-# Compute the normalized LCS given an answer text and a source text
-def lcs_norm_word(answer_text, source_text):
+# Split pre-processed text into the same word tokens CountVectorizer(analyzer='word') uses
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def tokenize(text):
+    '''Splits a pre-processed text into word tokens, dropping single character words
+       exactly like the default CountVectorizer token_pattern.
+       :param text: The pre-processed text
+       :return: A list of word tokens'''
+
+    return TOKEN_PATTERN.findall(text)
+
+
+# Count the ngrams of every requested size from a single tokenization of a text
+def ngram_profile(text, ngram_range):
+    '''Tokenizes a text once and builds hashed ngram counts for every n in ngram_range.
+       :param text: The pre-processed text
+       :param ngram_range: An iterable of ngram sizes, ex. range(1, 7)
+       :return: A dictionary mapping each n to a Counter of ngram (token tuple) counts'''
+
+    tokens = tokenize(text)
+
+    profile = {}
+    for n in ngram_range:
+        profile[n] = Counter(zip(*[tokens[i:] for i in range(n)]))
+
+    return profile
+
+
+# Build the ngram profile of every text in a df, keyed by file name
+def create_ngram_profiles(df, ngram_range):
+    '''Creates an ngram profile for each file in a df so texts are only tokenized once.
+       :param df: A dataframe with columns 'File' and 'Text'
+       :param ngram_range: An iterable of ngram sizes, ex. range(1, 7)
+       :return: A dictionary mapping each file name to its ngram profile'''
+
+    ngram_range = list(ngram_range)
+
+    return {file: ngram_profile(text, ngram_range) for file, text in zip(df['File'], df['Text'])}
+
+
+# Calculate the ngram containment from the ngram profiles of an answer and its source
+def profile_containment(answer_profile, source_profile, n):
+    '''Calculates the containment of an answer in its source from cached ngram profiles.
+       Gives the same value as calculate_containment without building a vectorizer.
+       :param answer_profile: The ngram profile of the answer text
+       :param source_profile: The ngram profile of the source text
+       :param n: An integer that defines the ngram size
+       :return: A single containment value'''
+
+    answer_counts = answer_profile[n]
+    answer_total = sum(answer_counts.values())
+    if answer_total == 0:
+        return np.nan
+
+    # Counter intersection keeps the minimum count of every shared ngram
+    shared = sum((answer_counts & source_profile[n]).values())
+
+    return shared/answer_total
+
+
+# Compute the normalized LCS given an answer text and a source text with the full DP matrix
+# Reference implementation, O(len(answer) x len(source)) time and memory
+def lcs_norm_word_dp(answer_text, source_text):
     '''Computes the longest common subsequence of words in two texts; returns a normalized value.
        :param answer_text: The pre-processed text for an answer text
        :param source_text: The pre-processed text for an answer's associated source text
@@ -193,20 +317,107 @@ def lcs_norm_word(answer_text, source_text):
     return arr_lcs[-1, -1]/len(arr_ans)
 
 
+# Map every word of a tokenized text to a bitmask of the positions it occurs at
+def lcs_match_masks(tokens):
+    '''Builds the match bitmasks used by the bit-parallel LCS, bit i is set in the mask
+       of the word at position i. Can be built once per source and reused for every answer.
+       :param tokens: A list of word tokens
+       :return: A dictionary mapping each word to an integer bitmask'''
+
+    masks = {}
+    for i, word in enumerate(tokens):
+        masks[word] = masks.get(word, 0) | (1 << i)
+
+    return masks
+
+
+# Compute the LCS length with the bit-vector algorithm of Allison-Dix/Hyyro
+def lcs_length_bitparallel(masks, length, tokens):
+    '''Computes the length of the longest common subsequence of two token lists, one row of
+       the DP matrix is packed into a single Python integer and updated with word-wide operations.
+       :param masks: The match bitmasks of the first token list, from lcs_match_masks
+       :param length: The number of tokens in the first token list
+       :param tokens: The second token list
+       :return: The LCS length'''
+
+    full = (1 << length) - 1
+    v = full
+
+    for word in tokens:
+        match = masks.get(word)
+        # words missing from the first list leave the row unchanged
+        if match:
+            u = v & match
+            v = ((v + u) | (v - u)) & full
+
+    # every zero bit is one step of the LCS
+    return length - bin(v).count('1')
+
+
+# Compute the normalized LCS given an answer text and a source text with the bit-parallel algorithm
+# Same value as lcs_norm_word_dp with O(len(source)) memory
+def lcs_norm_word_bitparallel(answer_text, source_text):
+    '''Computes the longest common subsequence of words in two texts; returns a normalized value.
+       :param answer_text: The pre-processed text for an answer text
+       :param source_text: The pre-processed text for an answer's associated source text
+       :return: A normalized LCS value'''
+
+    arr_ans = answer_text.split()
+    arr_src = source_text.split()
+
+    if len(arr_ans) == 0:
+        return np.nan
+
+    lcs = lcs_length_bitparallel(lcs_match_masks(arr_src), len(arr_src), arr_ans)
+
+    return lcs/len(arr_ans)
+
+
+# Available LCS backends, selected by name in lcs_norm_word and create_lcs_features
+LCS_METHODS = {'dp': lcs_norm_word_dp, 'bitparallel': lcs_norm_word_bitparallel}
+
+
+# Compute the normalized LCS given an answer text and a source text
+def lcs_norm_word(answer_text, source_text, method='bitparallel'):
+    '''Computes the longest common subsequence of words in two texts; returns a normalized value.
+       :param answer_text: The pre-processed text for an answer text
+       :param source_text: The pre-processed text for an answer's associated source text
+       :param method: The LCS backend, one of 'bitparallel' or 'dp' (reference)
+       :return: A normalized LCS value'''
+
+    return LCS_METHODS[method](answer_text, source_text)
+
+
 # Function returns a list of containment features, calculated for a given n
 # Should return a list of length 100 for all files in a complete_df
-def create_containment_features(df, n, column_name=None):
+# Pass the profiles from create_ngram_profiles to share one tokenization across all n
+# and a lookup from create_lookup to share one index of the df across all features
+# n_jobs > 1 (or -1 for all cores) computes the answers in a process pool, see create_features
+@instrument.timed()
+def create_containment_features(df, n, column_name=None, profiles=None, lookup=None, n_jobs=1, chunksize=None):
     containment_values = []
 
     if(column_name == None):
         column_name = 'c_'+str(n)  # c_1, c_2, .. c_n
 
+    if n_jobs != 1:
+        features = create_features(df, [n], lcs_method=None, lookup=lookup, n_jobs=n_jobs, chunksize=chunksize)
+        print(str(n)+'-gram containment features created!')
+        return features['c_'+str(n)]
+
+    if profiles is None:
+        profiles = create_ngram_profiles(df, [n])
+
+    if lookup is None:
+        lookup = create_lookup(df)
+
     # iterates through dataframe rows
-    for i in df.index:
-        file = df.loc[i, 'File']
-        # Computes features using calculate_containment function
-        if df.loc[i, 'Category'] > -1:
-            c = calculate_containment(df, n, file)
+    for file in df['File']:
+        row = lookup['rows'][file]
+        # Computes features from the cached ngram profiles
+        if row['Category'] > -1:
+            source_file = lookup['sources'][row['Task']]
+            c = profile_containment(profiles[file], profiles[source_file], n)
             containment_values.append(c)
         # Sets value to -1 for original tasks
         else:
@@ -216,25 +427,76 @@ def create_containment_features(df, n, column_name=None):
     return containment_values
 
 
+# Function returns the same list as create_containment_features, computed for the whole corpus at once
+# One vectorizer is fit over every text, each answer row of the count matrix is compared
+# with the row of its task source by a sparse element-wise minimum and row sums
+@instrument.timed()
+def create_containment_features_sparse(df, n, column_name=None, lookup=None):
+    '''Calculates the containment of every answer in its source from one corpus-wide count matrix.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and 'Text'
+       :param n: An integer that defines the ngram size
+       :param column_name: Unused, kept for the signature of create_containment_features
+       :param lookup: Optional prebuilt lookup from create_lookup(df)
+       :return: A list of containment values, source texts get -1'''
+
+    if lookup is None:
+        lookup = create_lookup(df)
+
+    files = list(df['File'])
+    position = {file: i for i, file in enumerate(files)}
+    answers = [i for i, file in enumerate(files) if lookup['rows'][file]['Category'] > -1]
+
+    containment_values = [-1] * len(files)
+    if not answers:
+        return containment_values
+
+    counts = CountVectorizer(analyzer='word', ngram_range=(n, n))
+    try:
+        matrix = counts.fit_transform([lookup['rows'][file]['Text'] for file in files]).tocsr()
+    except ValueError:
+        # no text of the corpus has an ngram of this size
+        for i in answers:
+            containment_values[i] = np.nan
+        return containment_values
+
+    # answers of one task all point at the same source row
+    sources = [position[lookup['sources'][lookup['rows'][files[i]]['Task']]] for i in answers]
+    answer_matrix = matrix[answers]
+    shared = np.asarray(answer_matrix.minimum(matrix[sources]).sum(axis=1)).ravel()
+    totals = np.asarray(answer_matrix.sum(axis=1)).ravel()
+
+    for i, shared_count, total in zip(answers, shared.tolist(), totals.tolist()):
+        containment_values[i] = shared_count/total if total > 0 else np.nan
+
+    print(str(n)+'-gram containment features created!')
+    return containment_values
+
+
 # Function creates lcs feature and add it to the dataframe
-def create_lcs_features(df, column_name='lcs_word'):
+@instrument.timed()
+def create_lcs_features(df, column_name='lcs_word', method='bitparallel', lookup=None, n_jobs=1, chunksize=None):
 
     lcs_values = []
 
+    if n_jobs != 1:
+        features = create_features(df, [], lcs_method=method, lookup=lookup, n_jobs=n_jobs, chunksize=chunksize)
+        print('LCS features created!')
+        return features['lcs_word']
+
+    if lookup is None:
+        lookup = create_lookup(df)
+
     # iterate through files in dataframe
-    for i in df.index:
+    for file in df['File']:
+        row = lookup['rows'][file]
         # Computes LCS_norm words feature using function above for answer tasks
-        if df.loc[i, 'Category'] > -1:
+        if row['Category'] > -1:
             # get texts to compare
-            answer_text = df.loc[i, 'Text']
-            task = df.loc[i, 'Task']
-            # we know that source texts have Class = -1
-            orig_rows = df[(df['Class'] == -1)]
-            orig_row = orig_rows[(orig_rows['Task'] == task)]
-            source_text = orig_row['Text'].values[0]
+            answer_text = row['Text']
+            source_text = lookup['rows'][lookup['sources'][row['Task']]]['Text']
 
             # calculate lcs
-            lcs = lcs_norm_word(answer_text, source_text)
+            lcs = lcs_norm_word(answer_text, source_text, method=method)
             lcs_values.append(lcs)
         # Sets to -1 for original tasks
         else:
@@ -244,6 +506,180 @@ def create_lcs_features(df, column_name='lcs_word'):
     return lcs_values
 
 
+# Version of the feature code, part of every feature cache key
+# Bump it whenever a change alters the value of any feature so cached values are not reused
+FEATURE_VERSION = 1
+
+# Per process state for _answer_features, set once per worker so the df is never pickled
+_worker_state = {}
+
+
+def _init_feature_worker(source_texts, ngram_range, lcs_method):
+    _worker_state.clear()
+    _worker_state.update(source_texts=source_texts, ngram_range=list(ngram_range),
+                         lcs_method=lcs_method, source_profiles={})
+
+
+# Computes all features of one (task, answer text) pair against the task source
+def _answer_features(answer):
+    task, answer_text = answer
+    ngram_range = _worker_state['ngram_range']
+    lcs_method = _worker_state['lcs_method']
+    source_text = _worker_state['source_texts'][task]
+
+    # each worker profiles a source the first time one of its answers needs it
+    source_profiles = _worker_state['source_profiles']
+    if task not in source_profiles:
+        source_profiles[task] = ngram_profile(source_text, ngram_range)
+
+    answer_profile = ngram_profile(answer_text, ngram_range)
+    values = [profile_containment(answer_profile, source_profiles[task], n) for n in ngram_range]
+    if lcs_method is not None:
+        values.append(lcs_norm_word(answer_text, source_text, method=lcs_method))
+
+    return values
+
+
+# Function creates the containment features for every n in ngram_range and the lcs feature in one pass
+@instrument.timed()
+def create_features(df, ngram_range, lcs_method='bitparallel', lookup=None, n_jobs=1, chunksize=None, cache=None):
+    '''Computes containment and LCS features for every answer in a df, optionally in a process pool.
+       Only the source texts are sent to each worker once and answers are sent in chunks of
+       (task, text) pairs. Results come back in row order and match the serial path exactly.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and 'Text'
+       :param ngram_range: An iterable of ngram sizes, ex. range(1, 7)
+       :param lcs_method: An LCS backend from LCS_METHODS, or None to skip the lcs feature
+       :param lookup: Optional prebuilt lookup from create_lookup(df)
+       :param n_jobs: Number of worker processes, 1 runs serially and -1 uses all cores
+       :param chunksize: Number of answers sent to a worker at a time, defaults to an even split
+       :param cache: Optional feature cache from feature_cache.open_cache, only answers
+           missing from the cache are computed
+       :return: A dictionary mapping feature names (c_1, .., c_n, lcs_word) to lists of values,
+           source texts get -1'''
+
+    ngram_range = list(ngram_range)
+    if lookup is None:
+        lookup = create_lookup(df)
+
+    columns = ['c_'+str(n) for n in ngram_range]
+    if lcs_method is not None:
+        columns.append('lcs_word')
+
+    rows = [lookup['rows'][file] for file in df['File']]
+    source_texts = {task: lookup['rows'][file]['Text'] for task, file in lookup['sources'].items()}
+    initargs = (source_texts, ngram_range, lcs_method)
+
+    n_jobs = _n_jobs(n_jobs)
+    with _feature_executor(n_jobs, initargs) as executor:
+        records = [(row['Task'], row['Text'], row['Category'] == -1) for row in rows]
+        return _record_features(records, columns, executor, n_jobs, chunksize, cache, source_texts)
+
+
+def _n_jobs(n_jobs):
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count()
+    return n_jobs
+
+
+# Process pool for _answer_features, or None to compute in this process
+def _feature_executor(n_jobs, initargs):
+    if n_jobs == 1:
+        _init_feature_worker(*initargs)
+        return contextlib.nullcontext()
+
+    return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_feature_worker, initargs=initargs)
+
+
+# Computes the features of (task, answer text) pairs in this process or in the pool, in order
+def _compute_answer_features(answers, executor, n_jobs, chunksize=None):
+    if executor is None:
+        return [_answer_features(answer) for answer in answers]
+
+    if chunksize is None:
+        chunksize = max(1, len(answers) // (n_jobs * 4))
+    return list(executor.map(_answer_features, answers, chunksize=chunksize))
+
+
+# Computes the features of (task, text, is_source) records and returns them in record order
+def _record_features(records, columns, executor, n_jobs, chunksize=None, cache=None, source_texts=None):
+    answers = [(task, text) for task, text, is_source in records if not is_source]
+
+    compute = partial(_compute_answer_features, executor=executor, n_jobs=n_jobs, chunksize=chunksize)
+    if cache is None:
+        answer_values = compute(answers)
+    else:
+        hits, misses = cache['hits'], cache['misses']
+        answer_values = feature_cache.cached_features(cache, answers, source_texts, columns, compute,
+                                                      FEATURE_VERSION)
+        instrument.count('cache_hits', cache['hits'] - hits)
+        instrument.count('cache_misses', cache['misses'] - misses)
+    instrument.count('answers_scored', len(answers))
+
+    # put answer values back in record order, source texts get -1
+    features = {column: [] for column in columns}
+    answer_values = iter(answer_values)
+    for _, _, is_source in records:
+        values = [-1] * len(columns) if is_source else next(answer_values)
+        for column, value in zip(columns, values):
+            features[column].append(value)
+
+    return features
+
+
+# Tokenize a source text once so single answers can be scored against it at request time
+def source_profile(text, ngram_range):
+    '''Builds the ngram profile and the LCS match bitmasks of a pre-processed source text.
+       :param text: The pre-processed source text
+       :param ngram_range: An iterable of ngram sizes, ex. [1, 5]
+       :return: A dictionary with the ngram 'profile', the LCS 'masks' and the word 'length' '''
+
+    words = text.split()
+    return {'profile': ngram_profile(text, ngram_range), 'masks': lcs_match_masks(words), 'length': len(words)}
+
+
+# Build the source profiles an inference container needs for a list of selected features
+def create_source_profiles(sources, features):
+    '''Profiles every task source for the selected features, see profile_features.
+       :param sources: A dictionary mapping each task to its (source file name, pre-processed text)
+       :param features: The selected features, containment 'c_<n>' and 'lcs_word'
+       :return: A dictionary with the 'features', the 'ngram_range', the source profiles by task
+           in 'sources' and the task of every source file name in 'files' '''
+
+    unknown = [feature for feature in features if feature != 'lcs_word' and not re.match(r'c_\d+$', feature)]
+    if unknown:
+        raise ValueError('Features {} cannot be computed from source profiles'.format(unknown))
+
+    ngram_range = sorted(set(int(feature[2:]) for feature in features if feature != 'lcs_word'))
+
+    return {'features': list(features), 'ngram_range': ngram_range,
+            'sources': {task: source_profile(text, ngram_range) for task, (_, text) in sources.items()},
+            'files': {file: task for task, (file, _) in sources.items()}}
+
+
+# Compute the selected features of one answer against a profiled source, same values as create_features
+def profile_features(answer_text, source, features, ngram_range):
+    '''Scores a pre-processed answer text against a profile from source_profile.
+       :param answer_text: The pre-processed answer text
+       :param source: The source profile
+       :param features: The selected features, containment 'c_<n>' and 'lcs_word'
+       :param ngram_range: The ngram sizes of the containment features
+       :return: A list with the value of every selected feature, in order'''
+
+    # the lcs feature alone needs no ngrams of the answer
+    answer_profile = ngram_profile(answer_text, ngram_range) if features != ['lcs_word'] else None
+
+    values = []
+    for feature in features:
+        if feature == 'lcs_word':
+            words = answer_text.split()
+            lcs = lcs_length_bitparallel(source['masks'], source['length'], words)
+            values.append(lcs/len(words) if words else np.nan)
+        else:
+            values.append(profile_containment(answer_profile, source['profile'], int(feature[2:])))
+
+    return values
+
+
 # Takes in dataframes and a list of selected features (column names)
 # and returns (train_x, train_y), (test_x, test_y)
 def train_test_data(complete_df, features_df, selected_features):
@@ -293,3 +729,189 @@ def make_csv(x, y, filename, data_dir):
 
     # nothing is returned, but a print statement indicates that the function has run
     print('Path created: '+str(data_dir)+'/'+str(filename))
+
+
+# Create npy files, the binary counterpart of make_csv
+def make_npy(x, y, filename, data_dir, feature_names=None, metadata=None):
+    '''Writes features and labels as one float32 array with labels in the first column, plus a json
+       sidecar with its shape and column names. The array can be memory-mapped by load_npy.
+       :param x: Data features
+       :param y: Data labels
+       :param filename: Name of npy file, ex. 'train.npy'
+       :param data_dir: The directory where files will be saved
+       :param feature_names: Optional names of the feature columns, ex. ['c_1', 'c_5', 'lcs_word']
+       :param metadata: Optional dictionary of json values added to the sidecar, ex. per row lists
+       '''
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    x = np.asarray(x, dtype=np.float32).reshape(len(y), -1)
+    data = np.empty((x.shape[0], x.shape[1] + 1), dtype=np.float32)
+    data[:, 0] = y
+    data[:, 1:] = x
+
+    path = os.path.join(data_dir, filename)
+    np.save(path, data)
+
+    if feature_names is None:
+        feature_names = ['f_'+str(i) for i in range(x.shape[1])]
+    sidecar = dict(metadata or {}, shape=list(data.shape), dtype='float32', label_column=0,
+                   columns=['Class'] + list(feature_names))
+    with open(os.path.splitext(path)[0] + '.json', 'w') as file:
+        json.dump(sidecar, file)
+
+    print('Path created: '+str(data_dir)+'/'+str(filename))
+
+
+def load_npy(path, mmap_mode='r'):
+    '''Opens an array written by make_npy without reading it into memory.
+       :param path: Path of the npy file
+       :param mmap_mode: Memory-map mode passed to np.load, None reads the whole array
+       :return: Features and labels as views of the array: (x, y)'''
+
+    data = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    if data.ndim != 2:
+        raise ValueError('Expected a 2d array in {}, got shape {}'.format(path, data.shape))
+
+    return data[:, 1:], data[:, 0]
+
+
+def load_sidecar(path):
+    '''Reads the json sidecar make_npy wrote next to an npy file.
+       :param path: Path of the npy file
+       :return: The sidecar dictionary'''
+
+    with open(os.path.splitext(path)[0] + '.json') as file:
+        return json.load(file)
+
+
+# Path and format of the features and labels exported as name.npy or name.csv in a directory
+# auto prefers the npy file, memory-mapped, when make_npy finished writing it (its sidecar exists)
+def _data_path(data_dir, name, data_format):
+    if data_format != 'auto':
+        return os.path.join(data_dir, name + '.' + data_format), data_format
+
+    npy_path = os.path.join(data_dir, name + '.npy')
+    if os.path.exists(npy_path) and os.path.exists(os.path.splitext(npy_path)[0] + '.json'):
+        return npy_path, 'npy'
+    csv_path = os.path.join(data_dir, name + '.csv')
+    if os.path.exists(csv_path):
+        return csv_path, 'csv'
+    raise FileNotFoundError('No {0}.npy or {0}.csv in {1}'.format(name, data_dir))
+
+
+# Read features and labels exported as name.npy or name.csv in a directory
+def load_data(data_dir, name, data_format='auto', mmap_mode='r'):
+    '''Loads the features and labels exported by the preprocessing.
+       :param data_dir: The directory of the exported files
+       :param name: The file name without extension, ex. 'train'
+       :param data_format: 'npy', 'csv', or 'auto' for the npy file if there is one, else the csv file
+       :param mmap_mode: Memory-map mode of npy files
+       :return: Features and labels: (x, y)'''
+
+    path, data_format = _data_path(data_dir, name, data_format)
+    if data_format == 'npy':
+        return load_npy(path, mmap_mode)
+
+    # Labels are in the first column
+    data = pd.read_csv(path, header=None, names=None)
+    return data.iloc[:, 1:], data.iloc[:, 0]
+
+
+# Read features and labels exported as name.npy or name.csv in chunks of rows
+def iter_data(data_dir, name, data_format='auto', chunksize=10000):
+    '''Yields the features and labels exported by the preprocessing a chunk of rows at a time, so only
+       one chunk is in memory: npy files are memory-mapped and sliced, csv files are parsed in chunks.
+       :param data_dir: The directory of the exported files
+       :param name: The file name without extension, ex. 'train'
+       :param data_format: 'npy', 'csv', or 'auto' for the npy file if there is one, else the csv file
+       :param chunksize: The number of rows per chunk
+       :return: A generator of float arrays: (x, y)'''
+
+    path, data_format = _data_path(data_dir, name, data_format)
+    if data_format == 'npy':
+        x, y = load_npy(path, mmap_mode='r')
+        for start in range(0, len(y), chunksize):
+            yield np.array(x[start:start + chunksize]), np.array(y[start:start + chunksize])
+        return
+
+    for data in pd.read_csv(path, header=None, names=None, chunksize=chunksize):
+        data = data.to_numpy(dtype=float)
+        yield data[:, 1:], data[:, 0]
+
+
+# Header of a raw float32 payload: rows and columns as little-endian uint32
+FLOAT32_HEADER = np.dtype('<u4')
+
+
+def pack_float32(x):
+    '''Serializes a 2d feature array as a shape header followed by the little-endian float32 values.
+       :param x: Data features
+       :return: The payload bytes'''
+
+    x = np.ascontiguousarray(np.atleast_2d(x), dtype='<f4')
+    return np.array(x.shape, dtype=FLOAT32_HEADER).tobytes() + x.tobytes()
+
+
+def unpack_float32(payload):
+    '''Reads a payload written by pack_float32 without copying the values.
+       :param payload: The payload bytes
+       :return: A read-only float32 array viewing the payload'''
+
+    header = FLOAT32_HEADER.itemsize * 2
+    if len(payload) < header:
+        raise ValueError('float32 payload shorter than its {} byte shape header'.format(header))
+
+    rows, columns = np.frombuffer(payload, dtype=FLOAT32_HEADER, count=2).tolist()
+    if len(payload) != header + rows * columns * 4:
+        raise ValueError('float32 payload of {} bytes does not hold a {}x{} array'.format(len(payload), rows, columns))
+
+    return np.frombuffer(payload, dtype='<f4', offset=header).reshape(rows, columns)
+
+
+def unpack_npy(payload):
+    '''Reads an npy payload without pickle and, for C ordered arrays, without copying the values.
+       :param payload: The bytes of an npy file
+       :return: The array'''
+
+    buffer = BytesIO(payload)
+    version = np.lib.format.read_magic(buffer)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+
+    if dtype.hasobject:
+        raise ValueError('npy payloads with python objects are not accepted')
+
+    count = int(np.prod(shape))
+    array = np.frombuffer(payload, dtype=dtype, count=count, offset=buffer.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+# Payload size from which parse_csv hands csv to the pandas C parser
+CSV_PANDAS_BYTES = 64 * 1024
+
+
+def parse_csv(payload):
+    '''Parses a headerless csv of numbers. Small payloads, ex. single rows, are parsed by numpy
+       without the setup cost of a pandas reader, large ones by the pandas C parser.
+       :param payload: The csv bytes or text, one row per line
+       :return: A 2d float array'''
+
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    if len(payload) >= CSV_PANDAS_BYTES:
+        return pd.read_csv(BytesIO(payload), header=None, dtype=np.float64).to_numpy()
+
+    lines = payload.decode('utf-8').strip().splitlines()
+    if not lines:
+        return np.zeros((0, 0))
+
+    values = np.fromstring(','.join(lines), dtype=float, sep=',')
+    columns = lines[0].count(',') + 1
+    if len(values) != len(lines) * columns:
+        raise ValueError('csv rows do not all have {} columns'.format(columns))
+
+    return values.reshape(len(lines), columns)
@@ -0,0 +1,88 @@
+import os
+
+import joblib
+import numpy as np
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+import helpers
+
+# Labels of the answers, partial_fit needs all of them on the first chunk
+CLASSES = np.array([0, 1])
+
+
+def create_model(n_features, n_components=500, gamma=None, seed=0):
+    '''Creates a linear SVM on random Fourier features, an approximation of SVC(gamma='auto') that is
+       trained one chunk at a time with partial_fit instead of fitting all rows at once.
+       :param n_features: The number of feature columns
+       :param n_components: The number of random Fourier features
+       :param gamma: The RBF kernel parameter, defaults to 1 / n_features as gamma='auto' does
+       :param seed: The random seed of the features and of the SGD shuffling
+       :return: An unfitted pipeline of an RBFSampler and an SGDClassifier'''
+
+    gamma = 1.0 / n_features if gamma is None else gamma
+    # the random weights only depend on the number of features, not on the data
+    sampler = RBFSampler(gamma=gamma, n_components=n_components, random_state=seed).fit(np.zeros((1, n_features)))
+    return Pipeline([('rbf', sampler), ('sgd', SGDClassifier(loss='hinge', random_state=seed))])
+
+
+def load_model(path):
+    '''Loads a model saved by an earlier incremental training to continue training it.
+       :param path: Path of the model.joblib file
+       :return: The pipeline'''
+
+    model = joblib.load(path)
+    if not isinstance(model, Pipeline) or not hasattr(model.steps[-1][1], 'partial_fit'):
+        raise ValueError('{} was not trained incrementally, its {} has no partial_fit'.format(
+            path, type(model).__name__))
+    return model
+
+
+def partial_fit(model, x, y, rng=None):
+    '''Trains a pipeline of create_model on one chunk of rows.
+       :param model: The pipeline
+       :param x: Data features of the chunk
+       :param y: Data labels of the chunk
+       :param rng: Optional numpy RandomState, shuffles the rows of the chunk
+       :return: The pipeline'''
+
+    if rng is not None:
+        order = rng.permutation(len(y))
+        x, y = x[order], y[order]
+    model.named_steps['sgd'].partial_fit(model.named_steps['rbf'].transform(x), y, classes=CLASSES)
+    return model
+
+
+def train_incremental(data_dir, model_path=None, data_format='auto', chunksize=10000, epochs=5, n_components=500,
+                      gamma=None, seed=0):
+    '''Trains on the exported train rows a chunk at a time, memory use is bounded by the chunk size.
+       :param data_dir: The directory of train.npy or train.csv
+       :param model_path: Optional model.joblib of an earlier incremental training to continue from, must exist
+       :param data_format: 'npy', 'csv', or 'auto' for the npy file if there is one, else the csv file
+       :param chunksize: The number of rows per chunk
+       :param epochs: The number of passes over the rows
+       :param n_components: The number of random Fourier features of a new model
+       :param gamma: The RBF kernel parameter of a new model, defaults to 1 / n_features
+       :param seed: The random seed
+       :return: The trained pipeline'''
+
+    model = None
+    if model_path is not None:
+        # a mistyped path would otherwise silently train a new model instead of the one asked for
+        if not os.path.exists(model_path):
+            raise FileNotFoundError('No model to continue training at {}'.format(model_path))
+        model = load_model(model_path)
+        print('Continuing training of '+model_path)
+
+    rng = np.random.RandomState(seed)
+    for epoch in range(epochs):
+        rows = 0
+        for x, y in helpers.iter_data(data_dir, 'train', data_format, chunksize):
+            if model is None:
+                model = create_model(x.shape[1], n_components, gamma, seed)
+            partial_fit(model, x, y, rng)
+            rows += len(y)
+        print('Epoch {}: {} rows'.format(epoch + 1, rows))
+
+    return model
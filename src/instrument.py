@@ -0,0 +1,172 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak RSS is left out of the report
+    resource = None
+
+# Instrumentation is off unless INSTRUMENT is set, stages and counters then cost one flag check
+ENABLED = os.environ.get('INSTRUMENT', '') not in ('', '0')
+
+# Also trace the python allocations of every stage, slows down allocation heavy code noticeably
+TRACEMALLOC = os.environ.get('INSTRUMENT_TRACEMALLOC', '') not in ('', '0')
+
+# Comma separated stages to run under cProfile ('*' for all), dumped to PROFILE_DIR/<stage>.prof
+PROFILE_STAGES = set(filter(None, os.environ.get('INSTRUMENT_PROFILE', '').split(',')))
+PROFILE_DIR = os.environ.get('INSTRUMENT_PROFILE_DIR', 'profiles')
+
+_state = {'enabled': False, 'tracemalloc': False, 'profile': set(), 'profile_dir': PROFILE_DIR,
+          'started': None, 'stages': {}, 'counters': Counter(), 'stack': [], 'profiling': False}
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def enable(trace_memory=TRACEMALLOC, profile=PROFILE_STAGES, profile_dir=PROFILE_DIR):
+    '''Starts recording stages and counters, the report covers everything since the last reset.
+       :param trace_memory: Record the tracemalloc high-water mark of every stage
+       :param profile: Names of the stages to run under cProfile, '*' for all
+       :param profile_dir: The directory the cProfile dumps are written to'''
+
+    _state.update(enabled=True, tracemalloc=trace_memory, profile=set(profile), profile_dir=profile_dir)
+    if _state['started'] is None:
+        _state['started'] = time.perf_counter()
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    _state['enabled'] = False
+    if _state['tracemalloc'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['tracemalloc'] = False
+
+
+def reset():
+    _state.update(started=time.perf_counter() if _state['enabled'] else None, stages={}, counters=Counter(),
+                  stack=[])
+
+
+def enabled():
+    return _state['enabled']
+
+
+def count(name, value=1):
+    '''Adds to a counter of the report, ex. documents or tokens processed.'''
+    if _state['enabled']:
+        _state['counters'][name] += value
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextlib.contextmanager
+def _record_stage(name):
+    entry = _state['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0})
+    frame = {'traced_peak': 0}
+    stack = _state['stack']
+
+    if _state['tracemalloc']:
+        # the peak of the enclosing stage so far, before this stage starts its own
+        if stack:
+            stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], tracemalloc.get_traced_memory()[1])
+        # python 3.9+, older versions report the peak since tracing started
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+    stack.append(frame)
+
+    # one profiler at a time, a nested profiled stage is part of the dump of the outer one
+    profiler = None
+    if (name in _state['profile'] or '*' in _state['profile']) and not _state['profiling']:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _state['profiling'] = True
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry['seconds'] += time.perf_counter() - start
+        entry['calls'] += 1
+        stack.pop()
+
+        if profiler is not None:
+            profiler.disable()
+            _state['profiling'] = False
+            os.makedirs(_state['profile_dir'], exist_ok=True)
+            profiler.dump_stats(os.path.join(_state['profile_dir'], name + '.prof'))
+
+        rss = peak_rss_mb()
+        if rss is not None:
+            entry['peak_rss_mb'] = rss
+        if _state['tracemalloc']:
+            traced_peak = max(frame['traced_peak'], tracemalloc.get_traced_memory()[1])
+            entry['tracemalloc_peak_mb'] = max(entry.get('tracemalloc_peak_mb', 0.0), traced_peak / 1024 ** 2)
+            if stack:
+                stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], traced_peak)
+
+
+def stage(name):
+    '''Context manager timing a stage of the pipeline, stages can nest and repeat.
+       Records the wall time, number of calls, peak RSS and, if enabled, the tracemalloc peak.
+       :param name: The stage name in the report
+       :return: A context manager, a shared no-op one when instrumentation is off'''
+
+    if not _state['enabled']:
+        return _NULL_STAGE
+    return _record_stage(name)
+
+
+def timed(name=None):
+    '''Decorator recording every call of a function as a stage, named after the function by default.'''
+
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return function(*args, **kwargs)
+            with _record_stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def report():
+    '''Builds the report of everything recorded since the last reset.
+       :return: A dictionary with the 'stages', the 'counters', the process 'peak_rss_mb' and the 'wall_seconds' '''
+
+    started = _state['started']
+    return {'stages': {name: dict(entry) for name, entry in _state['stages'].items()},
+            'counters': dict(_state['counters']),
+            'peak_rss_mb': peak_rss_mb(),
+            'wall_seconds': time.perf_counter() - started if started is not None else 0.0}
+
+
+def write_report(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(path, 'w') as file:
+        json.dump(report(), file, indent=2)
+    print('Instrumentation report written to '+path)
+
+
+if ENABLED or PROFILE_STAGES:
+    enable()
@@ -0,0 +1,167 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import ParameterGrid
+from sklearn.svm import SVC
+
+import helpers
+
+# Model families and the hyperparameter grids searched for each of them
+MODELS = {
+    'svc': (SVC, {'C': [0.1, 1, 10, 100], 'gamma': ['auto', 'scale', 0.1, 1, 10]}),
+    'random_forest': (RandomForestClassifier, {'n_estimators': [50, 200], 'max_depth': [None, 3, 6],
+                                               'random_state': [0]}),
+    'logistic_regression': (LogisticRegression, {'C': [0.01, 0.1, 1, 10], 'max_iter': [1000]}),
+}
+
+# Seeds of the train_test_dataframe splits every candidate can be scored on
+SEEDS = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+# Every (model name, parameters) pair of the grids
+def create_candidates(models=None):
+    models = MODELS if models is None else models
+    return [(name, params) for name in models for params in ParameterGrid(models[name][1])]
+
+
+def create_model(name, params):
+    return MODELS[name][0](**params)
+
+
+# Train and test row indices of the answers for every seeded split, drawn from the given rows only
+def create_splits(tasks, categories, seeds, rows=None):
+    rows = np.arange(len(tasks)) if rows is None else np.asarray(rows)
+    df = pd.DataFrame({'Task': np.asarray(tasks, dtype=object)[rows], 'Category': np.asarray(categories)[rows]})
+    splits = []
+    for seed in seeds:
+        datatype = helpers.train_test_dataframe(df, seed)['Datatype'].to_numpy()
+        splits.append((rows[datatype == 'train'], rows[datatype == 'test']))
+    return splits
+
+
+_worker_state = {}
+
+
+def _init_selection_worker(path, candidates, splits):
+    # the answers are memory-mapped, every worker reads the same pages instead of a pickled copy
+    _worker_state.clear()
+    x, y = helpers.load_npy(path, mmap_mode='r')
+    _worker_state.update(x=x, y=y, candidates=candidates, splits=splits)
+
+
+# Fits one candidate on the train rows of one split and scores it on the test rows
+def _evaluate(job):
+    candidate_index, split_index = job
+    name, params = _worker_state['candidates'][candidate_index]
+    train_rows, test_rows = _worker_state['splits'][split_index]
+    x, y = _worker_state['x'], _worker_state['y']
+
+    start = time.perf_counter()
+    model = create_model(name, params).fit(x[train_rows], y[train_rows])
+    fit_seconds = time.perf_counter() - start
+    accuracy = float(np.mean(model.predict(x[test_rows]) == y[test_rows]))
+
+    return candidate_index, split_index, accuracy, fit_seconds
+
+
+def successive_halving(candidates, n_splits, run_jobs, eta=3):
+    '''Scores every candidate on one split, keeps the best 1/eta of them and scores the rest on eta times
+       as many splits, until one candidate is left or all splits are used.
+       Candidates are ranked by their mean accuracy, ties go to the faster one to fit.
+       :param candidates: The list of (model name, parameters) pairs
+       :param n_splits: The number of splits available
+       :param run_jobs: A function that takes (candidate index, split index) jobs and returns their results
+       :param eta: The factor candidates are cut by and the budget grows by every round
+       :return: The index of the best candidate and the list of rounds, each with its budget and scores'''
+
+    alive = list(range(len(candidates)))
+    budget = 1
+    results = {}
+    rounds = []
+
+    while True:
+        budget = min(budget, n_splits)
+
+        # splits scored in an earlier round are not fitted again
+        start = time.perf_counter()
+        jobs = [(candidate, split) for candidate in alive for split in range(budget)
+                if (candidate, split) not in results]
+        for candidate, split, accuracy, fit_seconds in run_jobs(jobs):
+            results[(candidate, split)] = (accuracy, fit_seconds)
+
+        scores = {}
+        for candidate in alive:
+            scored = [results[(candidate, split)] for split in range(budget)]
+            scores[candidate] = (float(np.mean([accuracy for accuracy, _ in scored])),
+                                 float(np.mean([fit_seconds for _, fit_seconds in scored])))
+        alive = sorted(alive, key=lambda candidate: (-scores[candidate][0], scores[candidate][1]))
+
+        rounds.append({'splits': budget, 'jobs': len(jobs), 'seconds': time.perf_counter() - start,
+                       'scores': [{'candidate': candidate, 'accuracy': scores[candidate][0],
+                                   'fit_seconds': scores[candidate][1]} for candidate in alive]})
+        print('Round {}: {} candidates on {} splits, best accuracy {:.4f}'.format(
+            len(rounds), len(alive), budget, scores[alive[0]][0]))
+
+        if len(alive) == 1 or budget == n_splits:
+            return alive[0], rounds
+
+        alive = alive[:int(math.ceil(len(alive) / float(eta)))]
+        budget *= eta
+
+
+def select_model(path, seeds=None, n_jobs=1, eta=3, models=None):
+    '''Searches the model grids with successive halving over seeded train/test splits of the answers.
+       Only the answers exported to train.npy are split, the test.npy answers stay unseen by the search.
+       The answers are loaded once, memory-mapped, and shared read-only by the worker processes.
+       :param path: Path of the answers.npy file written by preprocess.py
+       :param seeds: The seeds of the splits, defaults to SEEDS
+       :param n_jobs: The number of worker processes, -1 uses all cores
+       :param eta: The factor candidates are cut by every round
+       :param models: Optional subset of MODELS to search
+       :return: The best (model name, parameters) pair and a report of the search'''
+
+    seeds = SEEDS if seeds is None else list(seeds)
+    candidates = create_candidates(models)
+    sidecar = helpers.load_sidecar(path)
+    if 'datatype' not in sidecar:
+        raise ValueError('{} has no datatype of its answers, run the export stage of preprocess.py again'.format(
+            path))
+    train_rows = np.flatnonzero(np.asarray(sidecar['datatype']) == 'train')
+    splits = create_splits(sidecar['task'], sidecar['category'], seeds, train_rows)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    initargs = (path, candidates, splits)
+    if n_jobs == 1:
+        _init_selection_worker(*initargs)
+        best, rounds = successive_halving(candidates, len(splits), lambda jobs: [_evaluate(job) for job in jobs],
+                                          eta)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_selection_worker,
+                                 initargs=initargs) as executor:
+            best, rounds = successive_halving(candidates, len(splits), lambda jobs: executor.map(_evaluate, jobs),
+                                              eta)
+
+    report = {'candidates': [{'model': name, 'params': params} for name, params in candidates],
+              'seeds': seeds, 'train_answers': len(train_rows), 'eta': eta, 'n_jobs': n_jobs, 'rounds': rounds,
+              'fits': sum(round_['jobs'] for round_ in rounds),
+              'seconds': time.perf_counter() - start,
+              'best': {'candidate': best, 'model': candidates[best][0], 'params': candidates[best][1],
+                       'accuracy': rounds[-1]['scores'][0]['accuracy']}}
+    return candidates[best], report
+
+
+def write_report(report, model_dir):
+    path = os.path.join(model_dir, 'model_selection.json')
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Model selection report written to '+path)
@@ -1,26 +1,195 @@
+import json
 import os
+import time
 from io import BytesIO, StringIO
 
 import joblib
 import numpy as np
 import pandas as pd
 
+import cascade
+import helpers
+
+
+# Memory-map the numpy arrays of the model, ex. the support vectors, instead of reading them ('r'), or None
+MODEL_MMAP_MODE = os.environ.get("MODEL_MMAP_MODE") or None
+
+# Models loaded by this process, keyed by model directory
+_models = {}
+
+
+def load_model(model_dir, mmap_mode=MODEL_MMAP_MODE, warm_up=True):
+    """Loads the model and source profiles of a model directory once per process.
+    A synthetic prediction at load time pays for the lazy initialization of the first request.
+    The load, warm-up and time to ready (both together) and the latency of the first request are kept
+    in the 'metrics' of the model.
+    """
+    key = (os.path.abspath(model_dir), mmap_mode)
+    if key in _models:
+        return _models[key]
+
+    start = time.perf_counter()
+    clf = joblib.load(os.path.join(model_dir, "model.joblib"), mmap_mode=mmap_mode)
+
+    # source profiles saved by train.py, needed to score raw answer texts
+    sources_path = os.path.join(model_dir, "sources.joblib")
+    sources = joblib.load(sources_path) if os.path.exists(sources_path) else None
+
+    # first stage trained by train.py --cascade, answer texts only get the expensive features when it is unsure
+    cascade_path = os.path.join(model_dir, "cascade.joblib")
+    first_stage = joblib.load(cascade_path) if os.path.exists(cascade_path) and sources is not None else None
+
+    model = {'model': clf, 'sources': sources, 'cascade': first_stage,
+             'metrics': {'load_seconds': time.perf_counter() - start}}
+
+    if warm_up:
+        warm_start = time.perf_counter()
+        warm_up_model(model)
+        model['metrics']['warm_up_seconds'] = time.perf_counter() - warm_start
+
+    # ready to serve, the idle time until the first request is not part of it
+    model['metrics']['ready_seconds'] = time.perf_counter() - start
+    print("Model loaded in {:.3f}s, warm-up {:.3f}s, ready in {:.3f}s.".format(
+        model['metrics']['load_seconds'], model['metrics'].get('warm_up_seconds', 0.0),
+        model['metrics']['ready_seconds']))
+    _models[key] = model
+    return model
+
+
+# Run a prediction on synthetic input through every path a request can take
+def warm_up_model(model):
+    clf = model['model']
+    n_features = getattr(clf, "n_features_in_", None)
+    if n_features is None and model['sources'] is not None:
+        n_features = len(model['sources']['features'])
+    if n_features is not None:
+        clf.predict(np.zeros((1, n_features)))
+
+    if model['sources'] is not None and model['sources']['sources']:
+        answers = [{"text": "warm up", "task": next(iter(model['sources']['sources']))}]
+        text_features(answers, model['sources'])
+        if model.get('cascade') is not None:
+            # a threshold above every probability takes both stages
+            cascade.predict_answers(model['cascade'], clf, text_answers(answers, model['sources']),
+                                    model['sources'], threshold=2.0)
+
 
 def model_fn(model_dir):
-    clf = joblib.load(os.path.join(model_dir, "model.joblib"))
-    return clf
+    return load_model(model_dir)
+
 
+# Content types of feature arrays and the parser of each
+FEATURE_PARSERS = {
+    # rows and columns as little-endian uint32, then the float32 values, decoded without a copy
+    "application/x-float32": helpers.unpack_float32,
+    "application/x-npy": helpers.unpack_npy,
+    "text/csv": helpers.parse_csv,
+}
 
-def input_fn(request_body, request_content_type):
-    """An input_fn that loads a pickled numpy array"""
-    if request_content_type == "application/python-pickle":
+
+def input_fn(request_body, request_content_type, model=None):
+    """An input_fn that loads a feature array or json answer texts.
+    Feature arrays come as a raw float32 buffer with a shape header (application/x-float32),
+    an npy file without pickled objects (application/x-npy), a headerless csv (text/csv)
+    or a pickled numpy array (application/python-pickle).
+    A json request is one {"text": ..., "task": ...} object or a list of them, the task
+    is the task id (ex. "a") or the file name of its source (ex. "orig_taska.txt").
+    Malformed answers and unknown tasks raise a ValueError, checked against the source profiles
+    of model or, when it is not given, of the model loaded by this process.
+    """
+    content_type = request_content_type.split(";")[0].strip()
+    if content_type in FEATURE_PARSERS:
+        if isinstance(request_body, str):
+            request_body = request_body.encode("utf-8")
+        return FEATURE_PARSERS[content_type](request_body)
+    elif content_type == "application/python-pickle":
         array = np.load(BytesIO(request_body), allow_pickle=True)
         return array
+    elif content_type == "application/json":
+        answers = json.loads(request_body)
+        if isinstance(answers, dict):
+            answers = [answers]
+        if model is None and len(_models) == 1:
+            model = next(iter(_models.values()))
+        if model is not None and model['sources'] is None:
+            raise ValueError("The model was saved without source profiles, send precomputed features instead")
+        validate_answers(answers, model['sources'] if model is not None else None)
+        return answers
     else:
         raise Exception(
-            "Please provide 'application/python-pickle' as a request content type")
+            "Please provide one of {} as a request content type".format(
+                ", ".join(list(FEATURE_PARSERS) + ["application/python-pickle", "application/json"])))
+
+
+# Checks json answers before they are queued, a bad answer is a client error and not retried
+def validate_answers(answers, sources=None):
+    if not isinstance(answers, list):
+        raise ValueError("Expected a json answer object or a list of them")
+    for index, answer in enumerate(answers):
+        if not isinstance(answer, dict):
+            raise ValueError("Answer {} is not a json object".format(index))
+        for key in ("text", "task"):
+            if not isinstance(answer.get(key), str):
+                raise ValueError("Answer {} needs a string '{}'".format(index, key))
+        if sources is not None and sources['files'].get(answer['task'], answer['task']) not in sources['sources']:
+            raise ValueError("Unknown task or source '{}'".format(answer['task']))
+
+
+# Pairs the normalized text of json answers with the profile of their source
+def text_answers(answers, sources):
+    if sources is None:
+        raise ValueError("The model was saved without source profiles, send precomputed features instead")
+
+    resolved = []
+    for answer in answers:
+        task = sources['files'].get(answer['task'], answer['task'])
+        if task not in sources['sources']:
+            raise ValueError("Unknown task or source '{}'".format(answer['task']))
+        resolved.append((helpers.normalize_text(answer['text']), sources['sources'][task]))
+    return resolved
+
+
+# Computes the features of json answer texts from the source profiles, without pandas
+def text_features(answers, sources):
+    features = [helpers.profile_features(text, source, sources['features'], sources['ngram_range'])
+                for text, source in text_answers(answers, sources)]
+
+    # answers shorter than n words share no ngram of size n with their source
+    return np.nan_to_num(np.array(features, dtype=float), nan=0.0)
 
 
 def predict_fn(input_data, model):
-    prediction = model.predict(input_data)
+    start = time.perf_counter()
+    if isinstance(input_data, list) and model.get('cascade') is not None:
+        prediction, decided = cascade.predict_answers(model['cascade'], model['model'],
+                                                      text_answers(input_data, model['sources']), model['sources'])
+        metrics = model.setdefault('metrics', {})
+        metrics['cascade_decided'] = metrics.get('cascade_decided', 0) + int(decided.sum())
+        metrics['cascade_deferred'] = metrics.get('cascade_deferred', 0) + int((~decided).sum())
+    else:
+        if isinstance(input_data, list):
+            input_data = text_features(input_data, model['sources'])
+        prediction = model['model'].predict(input_data)
+
+    # latency of the first request on its own, slower than the later ones when the warm-up missed a path
+    metrics = model.get('metrics')
+    if metrics is not None and 'first_request_seconds' not in metrics:
+        metrics['first_request_seconds'] = time.perf_counter() - start
+        print("First request predicted in {:.3f}s.".format(metrics['first_request_seconds']))
+
     return np.array(prediction).astype(int)
+
+
+def output_fn(prediction, accept):
+    """Serializes the predicted classes as json (default), one int8 per row (application/x-int8)
+    or one class per line (text/csv). Returns the body and its content type.
+    """
+    accept = (accept or "application/json").split(";")[0].strip()
+    if accept == "application/x-int8":
+        return np.asarray(prediction, dtype=np.int8).tobytes(), accept
+    elif accept == "text/csv":
+        return "\n".join(str(int(value)) for value in prediction), accept
+    elif accept in ("application/json", "*/*"):
+        return json.dumps(np.asarray(prediction).tolist()), "application/json"
+    else:
+        raise Exception("Please accept application/json, application/x-int8 or text/csv")
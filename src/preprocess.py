@@ -1,193 +1,336 @@
-import pandas as pd
-import numpy as np
+import argparse
+import glob
+import hashlib
+import json
 import os
-import helpers
-
-
-csv_file = 'data/file_information.csv'
-plagiarism_df = pd.read_csv(csv_file)
-
-
-# TESTING: Print out the first few rows of data info
-# print(plagiarism_df.head())
-
-# Create new `transformed_df`
-transformed_df = helpers.numerical_dataframe(csv_file)
-
-# TESTING: Print out the transformed dataframe
-# print('\nExample data: ')
-# print(transformed_df.head())
-
-# Create a text column
-text_df = helpers.create_text_column(transformed_df)
+import shutil
 
-# Check out the processed text for a single file, by row index
-row_idx = 0
-sample_text = text_df.iloc[0]['Text']
-
-# TESTING: Print out the sample processed text
-# print('Sample processed text:\n', sample_text)
-
-
-# STRATIFIED SAMPLING
-random_seed = 1
-
-# Create new dataframe with Datatype (train, test, orig) column
-# Pass `text_df` from above to create a complete dataframe, with all the information you need
-complete_df = helpers.train_test_dataframe(text_df, random_seed=random_seed)
-
-# TESTING: Check results of the complete dataframe
-# print(complete_df.head(10))
-
-# CONTAINMENT CALCULATION
-n = 3   # Select a value for n
-test_indices = range(5)   # Indices for first few files
+import pandas as pd
 
-# Iterate through files and calculate containment
-category_vals = []
-containment_vals = []
-for i in test_indices:
-    # Get level of plagiarism for a given file index
-    category_vals.append(complete_df.loc[i, 'Category'])
+import helpers
+import feature_cache
+import instrument
 
-    # Calculate containment for given file and n
-    filename = complete_df.loc[i, 'File']
-    c = helpers.calculate_containment(complete_df, n, filename)
-    containment_vals.append(c)
 
-# TESTING: Print out result
-# print('Original category values: \n', category_vals)
-# print()
-# print(str(n)+'-gram containment values: \n', containment_vals)
+# Stages of the pipeline in order, each persists its output in the work directory
+STAGES = ['ingest', 'normalize', 'split', 'features', 'export']
 
+# Number of worker processes (-1 uses all cores) and answers sent to a worker at a time for feature extraction
+N_JOBS = int(os.environ.get('N_JOBS', 1))
+CHUNK_SIZE = int(os.environ['CHUNK_SIZE']) if os.environ.get('CHUNK_SIZE') else None
 
-A = "i think pagerank is a link analysis algorithm used by google that uses a system of weights attached to each element of a hyperlinked set of documents"
-S = "pagerank is a link analysis algorithm used by the google internet search engine that assigns a numerical weighting to each element of a hyperlinked set of documents"
+# Feature cache file, features of unchanged answer/source pairs are read from it instead of recomputed
+FEATURE_CACHE = os.environ.get('FEATURE_CACHE')
 
-# Calculate LCS
-lcs = helpers.lcs_norm_word(A, S)
 
-# TESTING: Expected value test
-# print('LCS = ', lcs)
-# assert lcs==20/27., "Incorrect LCS value, expected about 0.7408, got " + str(lcs)
-# print('Test passed!')
+# Digest of the inputs of a stage, a stage is fresh when the digest in its stamp matches
+def stage_digest(*inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
 
-test_indices = range(5)   # look at first few files
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-category_vals = []
-lcs_norm_vals = []
 
-# Iterate through first few docs and calculate LCS
-for i in test_indices:
-    category_vals.append(complete_df.loc[i, 'Category'])
+def stamp_path(work_dir, stage):
+    return os.path.join(work_dir, stage + '.json')
 
-    # get texts to compare
-    answer_text = complete_df.loc[i, 'Text']
-    task = complete_df.loc[i, 'Task']
 
-    # we know that source texts have Class = -1
-    orig_rows = complete_df[(complete_df['Class'] == -1)]
-    orig_row = orig_rows[(orig_rows['Task'] == task)]
-    source_text = orig_row['Text'].values[0]
+def read_stamp(work_dir, stage):
+    '''Reads the stamp a stage wrote when it completed.
+       :param work_dir: The work directory of the pipeline
+       :param stage: The stage name
+       :return: The stamp dictionary with the stage 'digest' and its 'outputs', or None if the stage
+           never completed'''
 
-    # calculate lcs
-    lcs_val = helpers.lcs_norm_word(answer_text, source_text)
-    lcs_norm_vals.append(lcs_val)
+    path = stamp_path(work_dir, stage)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
 
 
-# TESTING: print out result
-# print('Original category values: \n', category_vals)
-# print()
-# print('Normalized LCS values: \n', lcs_norm_vals)
+def write_stamp(work_dir, stage, digest, outputs):
+    with open(stamp_path(work_dir, stage), 'w') as file:
+        json.dump({'stage': stage, 'digest': digest, 'outputs': outputs}, file)
 
 
-# CREATING LCS FEATURES
+# Digest of a completed upstream stage, part of the inputs of the stages that read its output
+def upstream_digest(args, stage):
+    stamp = read_stamp(args.work_dir, stage)
+    if stamp is None:
+        raise RuntimeError('Stage "{}" has no output in {}, run it first'.format(stage, args.work_dir))
+    return stamp['digest']
 
-# Create a features DataFrame by selecting an ngram_range
-ngram_range = range(1, 7)   # Define an ngram range
-features_list = []
 
-# Create features in a features_df
-all_features = np.zeros((len(ngram_range)+1, len(complete_df)))
+def ingest_inputs(args):
+    return stage_digest('ingest', args.csv_file, file_digest(args.csv_file))
 
-# Calculate features for containment for ngrams in range
-i = 0
-for n in ngram_range:
-    column_name = 'c_'+str(n)
-    features_list.append(column_name)
 
-    # create containment features
-    all_features[i] = np.squeeze(
-        helpers.create_containment_features(complete_df, n))
-    i += 1
+# Read the manifest and convert the categories to numerical values
+def ingest(args):
+    df = helpers.numerical_dataframe(args.csv_file)
+    df.to_pickle(os.path.join(args.work_dir, 'ingest.pkl'))
+    print('Ingested {} files from {}'.format(len(df), args.csv_file))
 
+    return [os.path.join(args.work_dir, 'ingest.pkl')]
 
-# Calculate features for LCS_Norm Words
-features_list.append('lcs_word')
-all_features[i] = np.squeeze(helpers.create_lcs_features(complete_df))
 
-# create a features dataframe
-features_df = pd.DataFrame(np.transpose(all_features), columns=features_list)
+def normalize_inputs(args):
+    df = pd.read_pickle(os.path.join(args.work_dir, 'ingest.pkl'))
 
-# TESTING: Print all features/columns
-# print()
-# print('Features: ', features_list)
-# print()
-# print (features_df.head(10))
+    # files are identified by size and modification time, hashing every text would cost as much as reading it
+    stats = []
+    for file in df['File']:
+        stat = os.stat(os.path.join(args.text_dir, file))
+        stats.append((file, stat.st_size, stat.st_mtime_ns))
 
+    return stage_digest('normalize', upstream_digest(args, 'ingest'), args.text_dir, stats,
+                        args.compat, args.part_size)
 
-# CORRELATED FEATURES
-# Create correlation matrix for just Features to determine different models to test
-corr_matrix = features_df.corr().abs().round(2)
 
-# TESTING: shows all of a dataframe
-# print (corr_matrix)
+# Read and normalize the text files, written in parts of part_size files so later stages stream them
+def normalize(args, digest):
+    df = pd.read_pickle(os.path.join(args.work_dir, 'ingest.pkl'))
 
+    part_dir = os.path.join(args.work_dir, 'normalize')
+    os.makedirs(part_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(part_dir, 'part-*.pkl')):
+        os.remove(path)
 
-# CREATE SELECTED TRAIN/TEST/DATA
-test_selection = list(features_df)[:2]  # first couple columns as a test
+    source_files = set(df.loc[df['Category'] == -1, 'File'])
+    sources = {}
+    columns = ['File', 'Task', 'Category']
+    for part, chunk in enumerate(helpers.iter_text_records(df, args.text_dir, args.part_size, compat=args.compat)):
+        part_df = df.iloc[part * args.part_size:part * args.part_size + len(chunk)][columns].copy()
+        part_df['Text'] = [text for _, _, text in chunk]
+        part_df.to_pickle(os.path.join(part_dir, 'part-{:05d}.pkl'.format(part)))
 
-# test that the correct train/test data is created
-(train_x, train_y), (test_x, test_y) = helpers.train_test_data(
-    complete_df, features_df, test_selection)
+        for file, task, text in chunk:
+            if file in source_files:
+                sources[task] = (file, text)
 
-# Select your list of features, this should be column names from features_df
-selected_features = ['c_1', 'c_5', 'lcs_word']
+    pd.to_pickle(sources, os.path.join(args.work_dir, 'sources.pkl'))
+    print('Normalized {} files'.format(len(df)))
 
-(train_x, train_y), (test_x, test_y) = helpers.train_test_data(
-    complete_df, features_df, selected_features)
+    return [os.path.join(args.work_dir, 'sources.pkl'), part_dir]
 
-# TESTING: Check that division of samples seems correct; These should add up to 95 (100 - 5 original files)
-# print('Training size: ', len(train_x))
-# print('Test size: ', len(test_x))
-# print()
-# print('Training df sample: \n', train_x[:10])
 
+def split_inputs(args):
+    return stage_digest('split', upstream_digest(args, 'ingest'), args.seed)
 
-# CREATE FINAL DATA FILES
 
+# Stratified train/test split, only needs the manifest columns
+def split(args, digest):
+    df = pd.read_pickle(os.path.join(args.work_dir, 'ingest.pkl'))
+    complete_df = helpers.train_test_dataframe(df, random_seed=args.seed)
+    complete_df.to_pickle(os.path.join(args.work_dir, 'split.pkl'))
+    print('Split: {}'.format(complete_df['Datatype'].value_counts().to_dict()))
 
-# Test cells
-fake_x = [[0.39814815, 0.0001, 0.19178082],
-          [0.86936937, 0.44954128, 0.84649123],
-          [0.44086022, 0., 0.22395833]]
+    return [os.path.join(args.work_dir, 'split.pkl')]
 
-fake_y = [0, 1, 1]
 
-helpers.make_csv(fake_x, fake_y, filename='to_delete.csv', data_dir='test_csv')
+def features_inputs(args):
+    return stage_digest('features', upstream_digest(args, 'normalize'), args.max_n, args.lcs_method,
+                        helpers.FEATURE_VERSION)
 
-# Read in and test dimensions
-fake_df = pd.read_csv('test_csv/to_delete.csv', header=None)
 
-# Check shape
-assert fake_df.shape == (3, 4), \
-    'The file should have as many rows as data_points and as many columns as features+1 (for indices).'
+# Containment and LCS features, one normalized part at a time
+# Finished parts are kept under the stage digest so a crashed run resumes from the first unfinished part,
+# --force computes them all again
+def features(args, digest):
+    sources = pd.read_pickle(os.path.join(args.work_dir, 'sources.pkl'))
+    source_rows = {file: {'Task': task, 'Category': -1, 'Text': text} for task, (file, text) in sources.items()}
+    ngram_range = range(1, args.max_n + 1)
+
+    part_dir = os.path.join(args.work_dir, 'features', digest[:16])
+    # parts of earlier digests are never resumed again
+    for path in glob.glob(os.path.join(args.work_dir, 'features', '*')):
+        if path != part_dir and os.path.isdir(path):
+            shutil.rmtree(path)
+    if args.force and os.path.isdir(part_dir):
+        shutil.rmtree(part_dir)
+    os.makedirs(part_dir, exist_ok=True)
 
-# TESTING: Check that first column = labels
-# assert np.all(fake_df.iloc[:,0].values==fake_y), 'First column is not equal to the labels, fake_y.'
-# print('Tests passed!')
+    cache = feature_cache.open_cache(args.feature_cache) if args.feature_cache else None
 
-data_dir = 'models'
-helpers.make_csv(train_x, train_y, filename='train.csv', data_dir=data_dir)
-helpers.make_csv(test_x, test_y, filename='test.csv', data_dir=data_dir)
+    parts = []
+    for path in sorted(glob.glob(os.path.join(args.work_dir, 'normalize', 'part-*.pkl'))):
+        out_path = os.path.join(part_dir, os.path.basename(path))
+        if not os.path.exists(out_path):
+            part_df = pd.read_pickle(path)
+            lookup = helpers.create_lookup(part_df)
+            lookup['rows'].update(source_rows)
+            lookup['sources'] = {task: file for task, (file, _) in sources.items()}
+
+            part_features = helpers.create_features(part_df, ngram_range, lcs_method=args.lcs_method,
+                                                    lookup=lookup, n_jobs=args.n_jobs,
+                                                    chunksize=args.chunksize, cache=cache)
+            part_features = pd.DataFrame(part_features, index=part_df.index)
+            part_features.insert(0, 'File', part_df['File'])
+
+            # written under a temporary name so an interrupted write is never taken for a finished part
+            part_features.to_pickle(out_path + '.tmp')
+            os.replace(out_path + '.tmp', out_path)
+        else:
+            print('Reusing {}'.format(out_path))
+            instrument.count('feature_parts_reused')
+        parts.append(pd.read_pickle(out_path))
+
+    if cache is not None:
+        print('Feature cache hits: '+str(cache['hits'])+', misses: '+str(cache['misses']))
+        feature_cache.close_cache(cache)
+
+    features_df = pd.concat(parts)
+    features_df.to_pickle(os.path.join(args.work_dir, 'features.pkl'))
+    print('Features created: '+', '.join(features_df.columns[1:]))
+
+    return [os.path.join(args.work_dir, 'features.pkl')]
+
+
+def export_inputs(args):
+    return stage_digest('export', upstream_digest(args, 'split'), upstream_digest(args, 'features'),
+                        args.selected_features, os.path.abspath(args.save_dir), args.export_format)
+
+
+# Write the selected features of the train and test rows as npy and/or csv files
+def export(args, digest):
+    complete_df = pd.read_pickle(os.path.join(args.work_dir, 'split.pkl'))
+    features_df = pd.read_pickle(os.path.join(args.work_dir, 'features.pkl'))
+
+    # align the features with the manifest rows by file name
+    features_df = features_df.set_index('File').loc[complete_df['File']].set_index(complete_df.index)
+
+    (train_x, train_y), (test_x, test_y) = helpers.train_test_data(
+        complete_df, features_df, args.selected_features)
+
+    # npy files of an earlier export would be loaded instead of the new csv files
+    if args.export_format == 'csv':
+        for name in ('train', 'test', 'answers'):
+            for extension in ('.npy', '.json'):
+                path = os.path.join(args.save_dir, name + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    outputs = []
+    for name, x, y in (('train', train_x, train_y), ('test', test_x, test_y)):
+        if args.export_format in ('npy', 'both'):
+            helpers.make_npy(x, y, filename=name+'.npy', data_dir=args.save_dir,
+                             feature_names=args.selected_features)
+            outputs.append(os.path.join(args.save_dir, name+'.npy'))
+        if args.export_format in ('csv', 'both'):
+            helpers.make_csv(x, y, filename=name+'.csv', data_dir=args.save_dir)
+            outputs.append(os.path.join(args.save_dir, name+'.csv'))
+
+    # every answer with its file, task, category and split: train.py --select draws its own seeded splits
+    # from them and cascade.py reads the texts of the test answers
+    if args.export_format in ('npy', 'both'):
+        answers = complete_df['Category'] > -1
+        helpers.make_npy(features_df.loc[answers, args.selected_features].to_numpy(),
+                         complete_df.loc[answers, 'Class'].to_numpy(), filename='answers.npy',
+                         data_dir=args.save_dir, feature_names=args.selected_features,
+                         metadata={column.lower(): complete_df.loc[answers, column].tolist()
+                                   for column in ('File', 'Task', 'Category', 'Datatype')})
+        outputs.append(os.path.join(args.save_dir, 'answers.npy'))
+
+    # the source texts and selected features, train.py turns them into the source profiles
+    # the inference container scores raw answer texts with
+    sources = pd.read_pickle(os.path.join(args.work_dir, 'sources.pkl'))
+    with open(os.path.join(args.save_dir, 'sources.json'), 'w') as file:
+        json.dump({'features': args.selected_features,
+                   'sources': {task: {'file': source_file, 'text': text}
+                               for task, (source_file, text) in sources.items()}}, file)
+    outputs.append(os.path.join(args.save_dir, 'sources.json'))
+
+    return outputs
+
+
+STAGE_INPUTS = {'ingest': ingest_inputs, 'normalize': normalize_inputs, 'split': split_inputs,
+                'features': features_inputs, 'export': export_inputs}
+STAGE_RUNS = {'ingest': lambda args, digest: ingest(args), 'normalize': normalize, 'split': split,
+              'features': features, 'export': export}
+
+
+# Run a stage unless the digest of its inputs matches the one of its last completed run
+# and the outputs of that run still exist
+def run_stage(args, stage):
+    digest = STAGE_INPUTS[stage](args)
+    stamp = read_stamp(args.work_dir, stage)
+    if (not args.force and stamp is not None and stamp['digest'] == digest
+            and all(os.path.exists(path) for path in stamp['outputs'])):
+        print('Skipping {}: up to date'.format(stage))
+        return
+
+    print('Running {}'.format(stage))
+    with instrument.stage(stage):
+        outputs = STAGE_RUNS[stage](args, digest)
+    write_stamp(args.work_dir, stage, digest, outputs)
+
+
+def main(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    stages = args.stages or STAGES
+    if args.resume_from:
+        stages = STAGES[STAGES.index(args.resume_from):]
+
+    if args.report:
+        instrument.enable()
+
+    for stage in STAGES:
+        if stage in stages:
+            run_stage(args, stage)
+
+    if instrument.enabled():
+        instrument.write_report(args.report or os.path.join(args.work_dir, 'report.json'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Preprocess the corpus and export train/test features. Stages whose inputs did not '
+                    'change since their last run are skipped.')
+    parser.add_argument('stages', nargs='*', help='stages to run, all by default: ' + ', '.join(STAGES))
+    parser.add_argument('--resume-from', type=str, choices=STAGES, default=None,
+                        help='run this stage and every stage after it')
+    parser.add_argument('--force', action='store_true', help='run the stages even if they are up to date')
+
+    # DATA_DIR and SAVE_DIR are set by the Makefile
+    parser.add_argument('--csv-file', type=str,
+                        default=os.environ.get('DATA_DIR', 'data/file_information.csv'))
+    parser.add_argument('--text-dir', type=str, default=None,
+                        help='directory of the text files, defaults to the directory of the csv file')
+    parser.add_argument('--save-dir', type=str, default=os.environ.get('SAVE_DIR', 'models'))
+    parser.add_argument('--work-dir', type=str, default=os.environ.get('WORK_DIR', 'work'))
+
+    parser.add_argument('--compat', action='store_true', help='legacy spacing of the normalized text')
+    parser.add_argument('--part-size', type=int, default=5000, help='files per normalized part')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-n', type=int, default=6)
+    parser.add_argument('--lcs-method', type=str, default='bitparallel', choices=list(helpers.LCS_METHODS))
+    parser.add_argument('--selected-features', type=str, nargs='+', default=['c_1', 'c_5', 'lcs_word'])
+    parser.add_argument('--export-format', type=str, default=os.environ.get('EXPORT_FORMAT', 'npy'),
+                        choices=['npy', 'csv', 'both'],
+                        help='npy writes float32 arrays with a json sidecar that training memory-maps')
+    parser.add_argument('--n-jobs', type=int, default=N_JOBS)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--feature-cache', type=str, default=FEATURE_CACHE)
+
+    # INSTRUMENT=1 also turns the report on, written to report.json in the work directory by default
+    parser.add_argument('--report', type=str, default=os.environ.get('INSTRUMENT_REPORT'),
+                        help='json file for the per stage timing, counter and memory report')
+
+    args = parser.parse_args()
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error('unknown stage "{}", choose from {}'.format(stage, ', '.join(STAGES)))
+
+    # file names are appended to the text directory
+    if args.text_dir is None:
+        args.text_dir = os.path.dirname(args.csv_file)
+    args.text_dir = os.path.join(args.text_dir, '')
+
+    main(args)
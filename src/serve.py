@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import predict
+
+
+# Reason phrases of the status codes the server answers with
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 411: 'Length Required', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+# Largest accepted request body
+MAX_BODY = 64 * 1024 * 1024
+
+
+# Create the state of the batching queue around a model loaded by predict.model_fn
+def create_batcher(model, max_batch=64, max_wait=0.005, max_queue=1024):
+    '''Creates a batcher that coalesces concurrent requests into one predict_fn call.
+       :param model: The model from predict.model_fn
+       :param max_batch: The maximum number of rows (feature rows or answer texts) per predict_fn call
+       :param max_wait: Seconds the first request of a batch waits for more requests
+       :param max_queue: Requests waiting for a batch before new ones are rejected with 503
+       :return: A batcher dictionary, run batch_loop on it to serve requests'''
+
+    return {'model': model, 'max_batch': max_batch, 'max_wait': max_wait,
+            'queue': asyncio.Queue(maxsize=max_queue),
+            # predict_fn runs in one thread so the event loop keeps accepting requests meanwhile
+            'executor': ThreadPoolExecutor(max_workers=1),
+            'metrics': {'requests': 0, 'rows': 0, 'batches': 0, 'rejected': 0, 'errors': 0,
+                        'max_queue_depth': 0, 'batch_rows': Counter(), 'predict_seconds': 0.0}}
+
+
+def request_rows(input_data):
+    return len(input_data) if isinstance(input_data, list) else np.atleast_2d(input_data).shape[0]
+
+
+# Queue the output of input_fn and wait for its predictions
+async def submit(batcher, input_data):
+    '''Adds a request to the next batch.
+       :param batcher: A batcher from create_batcher
+       :param input_data: The output of predict.input_fn, a feature array or a list of answers
+       :return: The predictions of the request rows
+       :raises asyncio.QueueFull: If max_queue requests are already waiting'''
+
+    future = asyncio.get_running_loop().create_future()
+    batcher['queue'].put_nowait((input_data, request_rows(input_data), future))
+
+    metrics = batcher['metrics']
+    metrics['requests'] += 1
+    metrics['max_queue_depth'] = max(metrics['max_queue_depth'], batcher['queue'].qsize())
+
+    return await future
+
+
+# Predict one batch, answer texts and feature arrays are predicted separately
+def predict_batch(model, requests):
+    predictions = [None] * len(requests)
+    for is_text in (True, False):
+        group = [i for i, (input_data, _, _) in enumerate(requests) if isinstance(input_data, list) == is_text]
+        if not group:
+            continue
+
+        if is_text:
+            batch = [answer for i in group for answer in requests[i][0]]
+        else:
+            batch = np.vstack([np.atleast_2d(requests[i][0]) for i in group])
+        prediction = predict.predict_fn(batch, model)
+
+        start = 0
+        for i in group:
+            rows = requests[i][1]
+            predictions[i] = prediction[start:start + rows]
+            start += rows
+
+    return predictions
+
+
+# Take requests off the queue and predict them in batches of up to max_batch rows
+async def batch_loop(batcher):
+    loop = asyncio.get_running_loop()
+    queue = batcher['queue']
+    metrics = batcher['metrics']
+
+    while True:
+        requests = [await queue.get()]
+        rows = requests[0][1]
+
+        # wait up to max_wait after the first request for the batch to fill
+        deadline = loop.time() + batcher['max_wait']
+        while rows < batcher['max_batch']:
+            if queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                request = queue.get_nowait()
+            requests.append(request)
+            rows += request[1]
+
+        start = time.perf_counter()
+        try:
+            predictions = await loop.run_in_executor(batcher['executor'], predict_batch, batcher['model'], requests)
+        except Exception:
+            # predict the requests one by one so a bad request only fails itself
+            predictions = []
+            for request in requests:
+                try:
+                    predictions.extend(await loop.run_in_executor(
+                        batcher['executor'], predict_batch, batcher['model'], [request]))
+                except Exception as error:
+                    metrics['errors'] += 1
+                    predictions.append(None)
+                    if not request[2].done():
+                        request[2].set_exception(error)
+
+        metrics['predict_seconds'] += time.perf_counter() - start
+        metrics['batches'] += 1
+        metrics['rows'] += rows
+        metrics['batch_rows'][rows] += 1
+
+        for (_, _, future), prediction in zip(requests, predictions):
+            if not future.done():
+                future.set_result(prediction)
+
+
+def metrics_report(batcher):
+    metrics = batcher['metrics']
+    report = dict(metrics, batch_rows={str(rows): count for rows, count in sorted(metrics['batch_rows'].items())})
+    report['queue_depth'] = batcher['queue'].qsize()
+    report['mean_batch_rows'] = metrics['rows'] / metrics['batches'] if metrics['batches'] else 0.0
+
+    # load, warm-up, time to ready and first request latency of the model
+    report['model'] = dict(batcher['model'].get('metrics', {}))
+    return report
+
+
+async def write_response(writer, status, body, content_type='application/json'):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    elif not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'.format(
+        status, REASONS[status], content_type, len(body)).encode('latin-1') + body)
+    await writer.drain()
+
+
+# Answer the requests of one keep-alive connection
+async def handle_connection(batcher, reader, writer):
+    '''Serves POST /invocations with the content types of predict.input_fn, GET /ping and GET /metrics.'''
+
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                await write_response(writer, 400, {'error': 'malformed request line'})
+                break
+            method, path = parts[:2]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                await write_response(writer, 400, {'error': 'invalid Content-Length'})
+                break
+            if length > MAX_BODY:
+                await write_response(writer, 413, {'error': 'request body over {} bytes'.format(MAX_BODY)})
+                break
+            body = await reader.readexactly(length) if length else b''
+
+            if method == 'GET' and path == '/ping':
+                await write_response(writer, 200, {'status': 'ok'})
+            elif method == 'GET' and path == '/metrics':
+                await write_response(writer, 200, metrics_report(batcher))
+            elif method == 'POST' and path == '/invocations':
+                await invocation(batcher, writer, body, headers.get('content-type', 'application/json'),
+                                 headers.get('accept', 'application/json'))
+            else:
+                await write_response(writer, 404, {'error': 'no route {} {}'.format(method, path)})
+
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def invocation(batcher, writer, body, content_type, accept):
+    try:
+        input_data = predict.input_fn(body, content_type, batcher['model'])
+        # reject an unsupported accept type before the request is queued
+        predict.output_fn([], accept)
+    except Exception as error:
+        await write_response(writer, 400, {'error': str(error)})
+        return
+
+    try:
+        prediction = await submit(batcher, input_data)
+    except asyncio.QueueFull:
+        # backpressure, clients retry later instead of growing the queue without bound
+        batcher['metrics']['rejected'] += 1
+        await write_response(writer, 503, {'error': 'queue full'})
+        return
+    except ValueError as error:
+        # input_fn checks the answers, this is a request predict_fn still found invalid
+        await write_response(writer, 400, {'error': str(error)})
+        return
+    except Exception as error:
+        await write_response(writer, 500, {'error': str(error)})
+        return
+
+    body, content_type = predict.output_fn(prediction, accept)
+    await write_response(writer, 200, body, content_type)
+
+
+async def serve(args):
+    batcher = create_batcher(predict.model_fn(args.model_dir), args.max_batch, args.max_wait_ms / 1000,
+                             args.max_queue)
+    loop_task = asyncio.ensure_future(batch_loop(batcher))
+
+    def handler(reader, writer):
+        return handle_connection(batcher, reader, writer)
+
+    if args.unix_socket:
+        server = await asyncio.start_unix_server(handler, path=args.unix_socket)
+        print('Serving on unix socket {}'.format(args.unix_socket))
+    else:
+        server = await asyncio.start_server(handler, args.host, args.port)
+        print('Serving on http://{}:{}'.format(args.host, args.port))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        loop_task.cancel()
+        batcher['executor'].shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local inference server with dynamic batching')
+    parser.add_argument('--model-dir', type=str, default=os.environ.get('SM_MODEL_DIR', 'model'),
+                        help='directory with model.joblib and the optional sources.joblib')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix-socket', type=str, default=None, help='serve on a unix socket instead of tcp')
+    parser.add_argument('--max-batch', type=int, default=64, help='maximum rows per predict_fn call')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='milliseconds a request waits for a batch to fill')
+    parser.add_argument('--max-queue', type=int, default=1024,
+                        help='waiting requests before new ones are rejected with 503')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args))
@@ -0,0 +1,223 @@
+import argparse
+import os
+import pickle
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+import helpers
+
+# Mersenne prime for the universal hash family (a * x + b) mod p, a < 2^29 and x < 2^32 keep it in uint64
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+# Create an empty MinHash/LSH index of reference (source) documents
+def create_source_index(num_perm=128, bands=64, n=2, window=200, seed=1):
+    '''Creates an empty source index. Documents are MinHashed over their word ngrams and the
+       signatures are split into bands, two documents become candidates when any band is identical.
+       With r = num_perm / bands rows per band, pairs above a Jaccard similarity of about
+       (1 / bands) ** (1 / r) are found with high probability.
+       Sources are indexed as overlapping windows of about an answer's length, an answer copied from
+       part of a long source has a low Jaccard similarity with the whole source but not with the window.
+       :param num_perm: The number of hash functions in a signature
+       :param bands: The number of LSH bands, must divide num_perm
+       :param n: The word ngram size of the shingles
+       :param window: The number of words per source window, windows overlap by half
+       :param seed: Seed of the hash functions, indexes only match queries with the same seed
+       :return: A source index dictionary'''
+
+    if num_perm % bands != 0:
+        raise ValueError('bands must divide num_perm, got {} and {}'.format(bands, num_perm))
+
+    rng = np.random.RandomState(seed)
+
+    return {'num_perm': num_perm, 'bands': bands, 'n': n, 'window': window, 'seed': seed,
+            'a': rng.randint(1, 1 << 29, size=num_perm).astype(np.uint64),
+            'b': rng.randint(0, 1 << 32, size=num_perm, dtype=np.int64).astype(np.uint64),
+            'buckets': [defaultdict(list) for _ in range(bands)],
+            'signatures': {}, 'texts': {}}
+
+
+# Stable 32 bit hashes of the distinct word ngrams of a token list
+def shingle_hashes(tokens, n):
+    shingles = {' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+
+# Compute the MinHash signature of a tokenized text
+def minhash(index, tokens):
+    '''Computes the MinHash signature of a token list with the hash functions of an index.
+       :param index: A source index from create_source_index
+       :param tokens: The word tokens, from helpers.tokenize
+       :return: (signature, number of distinct shingles), the signature is a uint32 array of num_perm values'''
+
+    hashes = shingle_hashes(tokens, index['n'])
+    if len(hashes) == 0:
+        return np.full(index['num_perm'], MAX_HASH, dtype=np.uint32), 0
+
+    permuted = (index['a'][:, None] * hashes[None, :] + index['b'][:, None]) % MERSENNE_PRIME
+    signature = (permuted & MAX_HASH).min(axis=1).astype(np.uint32)
+
+    return signature, len(hashes)
+
+
+# Overlapping windows of a long token list, a short list is a single window
+def _windows(index, tokens):
+    window = index['window']
+    stride = max(1, window // 2)
+    starts = range(0, max(1, len(tokens) - window + stride), stride)
+    return [tokens[start:start + window] for start in starts]
+
+
+def _band_keys(index, signature):
+    rows = index['num_perm'] // index['bands']
+    return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(index['bands'])]
+
+
+# Add a reference document, can be called at any time after the index is built
+def add_source(index, source_id, text, keep_text=True):
+    '''Adds (or replaces) a source document in the index.
+       :param index: A source index from create_source_index
+       :param source_id: A unique id for the source, ex. its file name
+       :param text: The pre-processed source text
+       :param keep_text: Store the text in the index so candidate_features can score against it'''
+
+    if source_id in index['signatures']:
+        remove_source(index, source_id)
+
+    signatures = []
+    for tokens in _windows(index, helpers.tokenize(text)):
+        signature, size = minhash(index, tokens)
+        for bucket, key in zip(index['buckets'], _band_keys(index, signature)):
+            bucket[key].append(source_id)
+        signatures.append((signature, size))
+
+    index['signatures'][source_id] = signatures
+    if keep_text:
+        index['texts'][source_id] = text
+
+
+def remove_source(index, source_id):
+    for signature, _ in index['signatures'].pop(source_id):
+        for bucket, key in zip(index['buckets'], _band_keys(index, signature)):
+            bucket[key].remove(source_id)
+            if not bucket[key]:
+                del bucket[key]
+    index['texts'].pop(source_id, None)
+
+
+# Find the top k candidate sources of an answer
+def query_sources(index, answer_text, k=5):
+    '''Returns the k sources most likely to contain the answer. Only sources sharing an LSH band
+       with the answer are scored, so the cost depends on the number of candidates, not the index size.
+       :param index: A source index from create_source_index
+       :param answer_text: The pre-processed answer text
+       :param k: The maximum number of candidates returned
+       :return: A list of (source_id, estimated containment) pairs, best first'''
+
+    signature, answer_size = minhash(index, helpers.tokenize(answer_text))
+    if answer_size == 0:
+        return []
+
+    candidates = set()
+    for bucket, key in zip(index['buckets'], _band_keys(index, signature)):
+        candidates.update(bucket.get(key, ()))
+
+    scores = []
+    for source_id in candidates:
+        best = 0.0
+        for window_signature, window_size in index['signatures'][source_id]:
+            jaccard = float(np.mean(window_signature == signature))
+            # |A & W| = J (|A| + |W|) / (1 + J), containment normalizes it by the answer size
+            shared = jaccard * (answer_size + window_size) / (1 + jaccard)
+            best = max(best, min(1.0, shared / answer_size))
+        scores.append((source_id, best))
+
+    scores.sort(key=lambda score: (-score[1], str(score[0])))
+    return scores[:k]
+
+
+# Run the containment and LCS features of an answer against its candidate sources only
+def candidate_features(index, answer_text, k=5, ngram_range=range(1, 7), lcs_method='bitparallel',
+                       source_texts=None):
+    '''Finds the candidate sources of an answer and computes the exact features against each of them.
+       :param index: A source index from create_source_index
+       :param answer_text: The pre-processed answer text
+       :param k: The maximum number of candidates scored
+       :param ngram_range: An iterable of ngram sizes, ex. range(1, 7)
+       :param lcs_method: An LCS backend from helpers.LCS_METHODS, or None to skip the lcs feature
+       :param source_texts: A dictionary mapping source ids to texts, defaults to the texts kept in the index
+       :return: A list of dictionaries with 'source', 'estimate' and the features c_1, .., c_n, lcs_word'''
+
+    if source_texts is None:
+        source_texts = index['texts']
+
+    ngram_range = list(ngram_range)
+    answer_profile = helpers.ngram_profile(answer_text, ngram_range)
+
+    results = []
+    for source_id, estimate in query_sources(index, answer_text, k):
+        source_text = source_texts[source_id]
+        source_profile = helpers.ngram_profile(source_text, ngram_range)
+
+        result = {'source': source_id, 'estimate': estimate}
+        for n in ngram_range:
+            result['c_'+str(n)] = helpers.profile_containment(answer_profile, source_profile, n)
+        if lcs_method is not None:
+            result['lcs_word'] = helpers.lcs_norm_word(answer_text, source_text, method=lcs_method)
+        results.append(result)
+
+    return results
+
+
+def save_source_index(index, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # defaultdicts are saved as plain dicts
+    data = dict(index, buckets=[dict(bucket) for bucket in index['buckets']])
+    with open(path, 'wb') as file:
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_source_index(path):
+    with open(path, 'rb') as file:
+        index = pickle.load(file)
+    index['buckets'] = [defaultdict(list, bucket) for bucket in index['buckets']]
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query a MinHash/LSH index of source documents')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='index the source texts (Category orig) of a csv file')
+    build.add_argument('--csv-file', type=str, default='data/file_information.csv')
+    build.add_argument('--data-dir', type=str, default='data/')
+    build.add_argument('--index', type=str, default='models/source_index.pkl')
+    build.add_argument('--append', action='store_true', help='add to an existing index')
+
+    query = subparsers.add_parser('query', help='find the candidate sources of answer files')
+    query.add_argument('files', nargs='+')
+    query.add_argument('--index', type=str, default='models/source_index.pkl')
+    query.add_argument('-k', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = load_source_index(args.index) if args.append else create_source_index()
+        df = helpers.numerical_dataframe(args.csv_file)
+        sources = df[df['Category'] == -1]
+        for file in sources['File']:
+            add_source(index, file, helpers.read_text(os.path.join(args.data_dir, file)))
+        save_source_index(index, args.index)
+        print('Indexed {} sources: {}'.format(len(sources), args.index))
+    else:
+        index = load_source_index(args.index)
+        for file in args.files:
+            for result in candidate_features(index, helpers.read_text(file), k=args.k):
+                print(file, result)
@@ -0,0 +1,198 @@
+import numpy as np
+
+import helpers
+
+
+# Build the suffix array of an integer sequence by prefix doubling
+def suffix_array(seq):
+    '''Sorts the suffixes of a sequence by prefix doubling. The suffixes ordered by their second key
+       are the previous order shifted by the step, so every step is a single stable sort by rank.
+       A step costs O(N log N) and the number of steps is log2 of the longest repeated substring,
+       O(N log^2 N) in the worst case but a few steps for answers that share no long passage.
+       :param seq: A 1d integer array
+       :return: An int64 array with the start positions of the suffixes in sorted order'''
+
+    n = len(seq)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    rank = np.unique(seq, return_inverse=True)[1].astype(np.int64).ravel()
+    order = np.argsort(rank, kind='stable')
+    step = 1
+    while True:
+        # suffixes shorter than the step have no second key and sort first, the others follow
+        # in the order of the suffix starting step words later
+        shifted = order[order >= step] - step
+        by_second = np.concatenate((np.arange(max(n - step, 0), n), shifted))
+        order = by_second[np.argsort(rank[by_second], kind='stable')]
+
+        second = np.full(n, -1, dtype=np.int64)
+        if step < n:
+            second[:n - step] = rank[step:]
+        changed = (rank[order][1:] != rank[order][:-1]) | (second[order][1:] != second[order][:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.concatenate(([0], np.cumsum(changed)))
+
+        if rank[order[-1]] == n - 1 or step >= n:
+            return order
+        step *= 2
+
+
+# Compute the longest common prefix of every pair of suffixes adjacent in the suffix array
+def lcp_array(seq, sa):
+    '''Kasai's algorithm, O(N).
+       :param seq: The sequence the suffix array was built on
+       :param sa: The suffix array of seq
+       :return: A list where item i is the LCP of suffixes sa[i - 1] and sa[i], item 0 is 0'''
+
+    n = len(seq)
+    seq = seq.tolist() if hasattr(seq, 'tolist') else list(seq)
+    sa = sa.tolist()
+    rank = [0] * n
+    for i, suffix in enumerate(sa):
+        rank[suffix] = i
+
+    lcp = [0] * n
+    h = 0
+    for i in range(n):
+        if rank[i] > 0:
+            j = sa[rank[i] - 1]
+            while i + h < n and j + h < n and seq[i + h] == seq[j + h]:
+                h += 1
+            lcp[rank[i]] = h
+            if h > 0:
+                h -= 1
+        else:
+            h = 0
+
+    return lcp
+
+
+# Compute every feature of one answer/source pair from a single suffix array
+def pair_features(answer_text, source_text, max_n=6, run_length=5):
+    '''Builds one suffix array over the word tokens of answer + source and derives from it:
+       the containment c_n for every n up to max_n (identical to calculate_containment), the length
+       of the longest common substring in words and the number of shared runs of run_length or more
+       words, counted by greedily tiling the answer with its longest matches in the source.
+       :param answer_text: The pre-processed answer text
+       :param source_text: The pre-processed source text
+       :param max_n: The largest ngram size
+       :param run_length: The minimum number of words of a counted shared run
+       :return: A dictionary with keys c_1, .., c_max_n, lcsubstr_len and runs_<run_length>'''
+
+    answer_tokens = helpers.tokenize(answer_text)
+    source_tokens = helpers.tokenize(source_text)
+    len_a = len(answer_tokens)
+
+    # map words to integer ids, the two separators are unique so no match crosses them
+    vocab = {}
+    seq = [vocab.setdefault(word, len(vocab)) for word in answer_tokens]
+    seq.append(-1)
+    seq.extend(vocab.setdefault(word, len(vocab)) for word in source_tokens)
+    seq.append(-2)
+    seq = np.array(seq, dtype=np.int64)
+    n = len(seq)
+
+    sa = suffix_array(seq)
+    lcp = lcp_array(seq, sa)
+
+    # 0 for answer suffixes, 1 for source suffixes, 2 for the separators
+    doc = np.where(sa < len_a, 0, np.where((sa > len_a) & (sa < n - 1), 1, 2)).tolist()
+
+    # bottom-up traversal of the lcp intervals, an interval with lcp l whose parent has lcp p
+    # is the group of suffixes sharing one ngram for every n in (p, l]
+    shared = [0] * (max_n + 2)
+    stack = [[0, 0, 0]]  # lcp, answer suffixes, source suffixes
+    for i in range(n):
+        boundary = lcp[i + 1] if i + 1 < n else 0
+        carry_a = 1 if doc[i] == 0 else 0
+        carry_s = 1 if doc[i] == 1 else 0
+        while boundary < stack[-1][0]:
+            depth, count_a, count_s = stack.pop()
+            count_a += carry_a
+            count_s += carry_s
+            parent = max(boundary, stack[-1][0])
+            if parent < max_n:
+                # difference array over n
+                both = min(count_a, count_s)
+                shared[parent + 1] += both
+                shared[min(depth, max_n) + 1] -= both
+            carry_a, carry_s = count_a, count_s
+        if boundary > stack[-1][0]:
+            stack.append([boundary, carry_a, carry_s])
+        else:
+            stack[-1][1] += carry_a
+            stack[-1][2] += carry_s
+
+    features = {}
+    running = 0
+    for ngram in range(1, max_n + 1):
+        running += shared[ngram]
+        total = len_a - ngram + 1
+        features['c_'+str(ngram)] = running/total if total > 0 else np.nan
+
+    # longest common substring, the largest lcp between an answer and a source suffix
+    longest = 0
+    for i in range(1, n):
+        if doc[i - 1] + doc[i] == 1:
+            longest = max(longest, lcp[i])
+    features['lcsubstr_len'] = longest
+
+    # matching statistics: longest prefix of every answer suffix found in the source,
+    # the minimum lcp to the nearest source suffix on either side in the suffix array
+    matches = [0] * len_a
+    for ranks in (range(n), range(n - 1, -1, -1)):
+        current = 0
+        previous = None
+        for i in ranks:
+            if previous is not None:
+                current = min(current, lcp[max(i, previous)])
+            if doc[i] == 0:
+                matches[sa[i]] = max(matches[sa[i]], current)
+            elif doc[i] == 1:
+                current = n
+            previous = i
+
+    runs = 0
+    i = 0
+    while i < len_a:
+        if matches[i] >= run_length:
+            runs += 1
+            i += matches[i]
+        else:
+            i += 1
+    features['runs_'+str(run_length)] = runs
+
+    return features
+
+
+# Function creates the containment features for every n up to max_n plus the substring features
+# from one suffix array per answer, with the column names of create_containment_features
+def create_suffix_features(df, max_n=6, run_length=5, lookup=None):
+    '''Computes the suffix array features for every answer in a df.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and 'Text'
+       :param max_n: The largest ngram size
+       :param run_length: The minimum number of words of a counted shared run
+       :param lookup: Optional prebuilt lookup from helpers.create_lookup(df)
+       :return: A dictionary mapping c_1, .., c_max_n, lcsubstr_len and runs_<run_length>
+           to lists of values, source texts get -1'''
+
+    if lookup is None:
+        lookup = helpers.create_lookup(df)
+
+    columns = ['c_'+str(n) for n in range(1, max_n + 1)] + ['lcsubstr_len', 'runs_'+str(run_length)]
+    features = {column: [] for column in columns}
+
+    for file in df['File']:
+        row = lookup['rows'][file]
+        if row['Category'] > -1:
+            source_text = lookup['rows'][lookup['sources'][row['Task']]]['Text']
+            values = pair_features(row['Text'], source_text, max_n, run_length)
+        # Sets values to -1 for original tasks
+        else:
+            values = dict.fromkeys(columns, -1)
+        for column in columns:
+            features[column].append(values[column])
+
+    print('Suffix array features created!')
+    return features
@@ -1,26 +1,22 @@
 from __future__ import print_function
 
 import argparse
+import json
 import os
 import joblib
-import pandas as pd
+import numpy as np
 
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.svm import SVC
 
+import cascade
+import helpers
+import incremental
+import model_selection
 
-# Provided model load function
-def model_fn(model_dir):
-    """Load model from the model_dir. This is the same model that is saved
-    in the main if statement.
-    """
-    print("Loading model.")
-    
-    # load using joblib
-    model = joblib.load(os.path.join(model_dir, "model.joblib"))
-    print("Done loading model.")
-    
-    return model
+# Model loading and serving for an endpoint deployed from this entry point, shared with predict.py:
+# the model is loaded once per process, optionally memory-mapped, and warmed up before the first request
+from predict import model_fn, input_fn, predict_fn, output_fn  # noqa: F401
 
 
 if __name__ == '__main__':
@@ -36,22 +32,88 @@ if __name__ == '__main__':
     parser.add_argument('--model-dir', type=str, default=os.environ['SM_MODEL_DIR'])
     parser.add_argument('--data-dir', type=str, default=os.environ['SM_CHANNEL_TRAIN'])
 
+    # train.npy is memory-mapped, train.csv parsed; auto takes train.npy when it was exported
+    parser.add_argument('--data-format', type=str, default='auto', choices=['auto', 'npy', 'csv'])
+
+    # Search SVC, random forest and logistic regression grids on seeded splits of answers.npy instead of
+    # training the default SVC, bad candidates are dropped after a few splits by successive halving
+    parser.add_argument('--select', action='store_true')
+    parser.add_argument('--seeds', type=int, nargs='+', default=model_selection.SEEDS)
+    parser.add_argument('--n-jobs', type=int, default=int(os.environ.get('N_JOBS', 1)))
+    parser.add_argument('--eta', type=int, default=3)
+
+    # Train an SGD classifier on random Fourier features a chunk of rows at a time instead of the SVC,
+    # memory use is bounded by the chunk size; --warm-start continues training an earlier model.joblib
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--n-components', type=int, default=500)
+    parser.add_argument('--rbf-gamma', type=float, default=None)
+    parser.add_argument('--warm-start', type=str, default=None, help='model.joblib of an incremental training')
+
+    # Also train a first stage on the containment features that decides the answer texts it is confident
+    # about, the endpoint then computes lcs_word only for the rest; see cascade.py for accuracy and latency
+    parser.add_argument('--cascade', action='store_true')
+    parser.add_argument('--cascade-threshold', type=float, default=0.9)
+
     # args holds all passed-in arguments
     args = parser.parse_args()
+    if args.select and args.incremental:
+        parser.error('--select and --incremental cannot be combined')
+    if args.warm_start and not args.incremental:
+        parser.error('--warm-start needs --incremental')
+    if args.warm_start and not os.path.exists(args.warm_start):
+        parser.error('--warm-start {} does not exist'.format(args.warm_start))
+    if args.cascade and not os.path.exists(os.path.join(args.data_dir, "sources.json")):
+        parser.error('--cascade needs the sources.json of the preprocessing')
 
-    # Read in csv training file
-    training_dir = args.data_dir
-    train_data = pd.read_csv(os.path.join(training_dir, "train.csv"), header=None, names=None)
-
-    # Labels are in the first column
-    train_y = train_data.iloc[:,0]
-    train_x = train_data.iloc[:,1:]
+    # Read in the training file, labels are in the first column
+    if not args.incremental:
+        train_x, train_y = helpers.load_data(args.data_dir, 'train', args.data_format)
     
     # Define a model 
-    model = SVC(gamma = 'auto')
+    if args.incremental:
+        model = incremental.train_incremental(args.data_dir, args.warm_start, args.data_format, args.chunksize,
+                                              args.epochs, args.n_components, args.rbf_gamma)
+    elif args.select:
+        (name, params), report = model_selection.select_model(
+            os.path.join(args.data_dir, "answers.npy"), args.seeds, args.n_jobs, args.eta)
+        print("Selected {} {}".format(name, params))
+        model = model_selection.create_model(name, params)
+    else:
+        model = SVC(gamma = 'auto')
     
     # Train the model
-    model.fit(train_x, train_y)
+    if not args.incremental:
+        model.fit(train_x, train_y)
 
     # Save the trained model
     joblib.dump(model, os.path.join(args.model_dir, "model.joblib"))
+
+    # Save the search report with the accuracy of the selected model on the exported test set
+    if args.select:
+        test_x, test_y = helpers.load_data(args.data_dir, 'test', args.data_format)
+        report['test_accuracy'] = float((model.predict(test_x) == test_y).mean())
+        print("Test accuracy: {:.4f}".format(report['test_accuracy']))
+        model_selection.write_report(report, args.model_dir)
+
+    # Save the source profiles the endpoint scores raw answer texts with
+    sources_path = os.path.join(args.data_dir, "sources.json")
+    if os.path.exists(sources_path):
+        with open(sources_path) as file:
+            exported = json.load(file)
+        sources = {task: (source['file'], source['text']) for task, source in exported['sources'].items()}
+        profiles = helpers.create_source_profiles(sources, exported['features'])
+        joblib.dump(profiles, os.path.join(args.model_dir, "sources.joblib"))
+        print("Saved profiles of {} sources.".format(len(sources)))
+
+    # Save the first stage of the cascade with its accuracy on the exported test set
+    if args.cascade:
+        train_x, train_y = helpers.load_data(args.data_dir, 'train', args.data_format)
+        first_stage = cascade.create_cascade(train_x, train_y, exported['features'], args.cascade_threshold)
+        joblib.dump(first_stage, os.path.join(args.model_dir, "cascade.joblib"))
+
+        test_x, test_y = helpers.load_data(args.data_dir, 'test', args.data_format)
+        prediction, decided = cascade.predict_features(first_stage, model, test_x, exported['features'])
+        print("Cascade test accuracy: {:.4f}, {:.0%} decided by the first stage.".format(
+            (prediction == np.asarray(test_y)).mean(), decided.mean()))
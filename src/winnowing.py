@@ -0,0 +1,125 @@
+import os
+import pickle
+import zlib
+from collections import Counter, defaultdict
+
+import helpers
+
+
+# Hash every word k-gram of a text, in order
+def kgram_hashes(text, k):
+    tokens = helpers.tokenize(text)
+    return [zlib.crc32(' '.join(tokens[i:i + k]).encode('utf-8')) for i in range(len(tokens) - k + 1)]
+
+
+# Select the winnowed fingerprints of a text
+def fingerprints(text, k=5, window=4):
+    '''Computes the winnowed fingerprints of a text (Schleimer, Wilkerson and Aiken, the MOSS algorithm).
+       The minimum k-gram hash of every window of consecutive hashes is selected, so any run of at
+       least window + k - 1 words shared by two texts gives both of them a common fingerprint.
+       :param text: The pre-processed text
+       :param k: The word ngram size of the hashed k-grams
+       :param window: The number of consecutive k-gram hashes in a winnowing window
+       :return: The set of selected fingerprint hashes'''
+
+    hashes = kgram_hashes(text, k)
+    if len(hashes) <= window:
+        return {min(hashes)} if hashes else set()
+
+    # minimum of every window, only the set of selected hashes is kept so the
+    # position tie-breaking of the original algorithm does not change the result
+    return set(map(min, zip(*[hashes[i:] for i in range(window)])))
+
+
+# Create an empty inverted index of source fingerprints
+def create_fingerprint_index(k=5, window=4):
+    '''Creates an empty fingerprint index, sources are fingerprinted once when added and
+       answers are scored against all of them from the answer's own fingerprints only.
+       :param k: The word ngram size of the hashed k-grams
+       :param window: The winnowing window size
+       :return: A fingerprint index dictionary'''
+
+    return {'k': k, 'window': window, 'postings': defaultdict(set), 'sources': {}}
+
+
+def add_fingerprints(index, source_id, text):
+    '''Adds (or replaces) a source text in a fingerprint index.
+       :param index: A fingerprint index from create_fingerprint_index
+       :param source_id: A unique id for the source, ex. its task or file name
+       :param text: The pre-processed source text'''
+
+    if source_id in index['sources']:
+        for fingerprint in index['sources'].pop(source_id):
+            index['postings'][fingerprint].discard(source_id)
+
+    source_fingerprints = fingerprints(text, index['k'], index['window'])
+    for fingerprint in source_fingerprints:
+        index['postings'][fingerprint].add(source_id)
+    index['sources'][source_id] = source_fingerprints
+
+
+# Estimate the containment of an answer in every indexed source
+def fingerprint_containment(index, answer_text):
+    '''Estimates the k-gram containment of an answer in the indexed sources as the share of the
+       answer's fingerprints found in each source. The cost is proportional to the answer length.
+       :param index: A fingerprint index from create_fingerprint_index
+       :param answer_text: The pre-processed answer text
+       :return: A dictionary mapping the id of every source sharing a fingerprint to its estimate'''
+
+    answer_fingerprints = fingerprints(answer_text, index['k'], index['window'])
+    if not answer_fingerprints:
+        return {}
+
+    shared = Counter()
+    for fingerprint in answer_fingerprints:
+        shared.update(index['postings'].get(fingerprint, ()))
+
+    return {source_id: count/len(answer_fingerprints) for source_id, count in shared.items()}
+
+
+# Function returns a list of estimated containment features, the winnowing counterpart of
+# helpers.create_containment_features for a given n
+def create_fingerprint_features(df, n, window=4, index=None, lookup=None):
+    '''Estimates the n-gram containment of every answer in a df in its task source from fingerprints.
+       :param df: A dataframe with columns 'File', 'Task', 'Category' and 'Text'
+       :param n: The word ngram size
+       :param window: The winnowing window size
+       :param index: Optional prebuilt index of the task sources, keyed by task
+       :param lookup: Optional prebuilt lookup from helpers.create_lookup(df)
+       :return: A list of estimated containment values, source texts get -1'''
+
+    if lookup is None:
+        lookup = helpers.create_lookup(df)
+
+    if index is None:
+        index = create_fingerprint_index(n, window)
+        for task, source_file in lookup['sources'].items():
+            add_fingerprints(index, task, lookup['rows'][source_file]['Text'])
+
+    values = []
+    for file in df['File']:
+        row = lookup['rows'][file]
+        if row['Category'] > -1:
+            values.append(fingerprint_containment(index, row['Text']).get(row['Task'], 0.0))
+        # Sets value to -1 for original tasks
+        else:
+            values.append(-1)
+
+    return values
+
+
+def save_fingerprint_index(index, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    data = dict(index, postings=dict(index['postings']))
+    with open(path, 'wb') as file:
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_fingerprint_index(path):
+    with open(path, 'rb') as file:
+        index = pickle.load(file)
+    index['postings'] = defaultdict(set, index['postings'])
+    return index